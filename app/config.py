@@ -7,6 +7,12 @@ load_dotenv()
 APP_PORT = int(os.getenv("APP_PORT", "8001"))
 DATA_DIR = os.getenv("DATA_DIR", "./data")
 IMAGES_DIR = os.path.join(DATA_DIR, "images")
+THUMBS_DIR = os.path.join(DATA_DIR, "thumbs")
+PROFILES_DIR = os.path.join(DATA_DIR, "profiles")
+# Anchos permitidos para miniaturas /files/<id>.png?w=<ancho>
+FILES_THUMB_WIDTHS = sorted({int(w) for w in os.getenv("FILES_THUMB_WIDTHS", "128,256,512").split(",") if w.strip()})
+# Delegar el envío a un proxy (nginx X-Accel-Redirect) con este prefijo interno; vacío = desactivado
+FILES_ACCEL_REDIRECT_PREFIX = os.getenv("FILES_ACCEL_REDIRECT_PREFIX", "")
 # Optional external base URL (e.g., https://cdn.example.com) without trailing slash
 BASE_URL = os.getenv("BASE_URL", "")
 
@@ -14,6 +20,25 @@ BASE_URL = os.getenv("BASE_URL", "")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "stabilityai/sdxl-turbo")
 ALLOWED_MODELS = [m.strip() for m in os.getenv("ALLOWED_MODELS", DEFAULT_MODEL).split(",") if m.strip()]
 MAX_MODELS_CACHE = int(os.getenv("MAX_MODELS_CACHE", "2"))
+# Réplicas (ejecuciones concurrentes) por modelo. MODEL_REPLICAS_OVERRIDES="modelo=2,otro=1"
+MODEL_REPLICAS = max(1, int(os.getenv("MODEL_REPLICAS", "1")))
+MODEL_REPLICAS_OVERRIDES = {
+	k.strip(): max(1, int(v))
+	for k, _, v in (item.partition("=") for item in os.getenv("MODEL_REPLICAS_OVERRIDES", "").split(","))
+	if k.strip() and v.strip()
+}
+
+def replicas_for(model_id: str) -> int:
+	"""Número de réplicas (pipelines independientes) permitidas para un modelo."""
+	return MODEL_REPLICAS_OVERRIDES.get(model_id, MODEL_REPLICAS)
+
+# Caché de latents para refinados (0 = desactivado)
+LATENT_CACHE_SIZE = int(os.getenv("LATENT_CACHE_SIZE", "0"))
+LATENT_CACHE_DISK_SIZE = int(os.getenv("LATENT_CACHE_DISK_SIZE", "0"))
+LATENTS_DIR = os.path.join(DATA_DIR, "latents")
+
+# Drenaje: Retry-After de los 503
+DRAIN_RETRY_AFTER_SECONDS = int(os.getenv("DRAIN_RETRY_AFTER_SECONDS", "10"))
 
 # Generation timeout (seconds). 0 or negative disables.
 def generation_timeout_seconds() -> float:
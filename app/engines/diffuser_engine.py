@@ -1,6 +1,10 @@
-from typing import Optional
+from contextlib import nullcontext
+from typing import Dict, Optional, Tuple
 import torch
-from diffusers import AutoPipelineForText2Image
+import torch.nn.functional as F
+import diffusers
+from diffusers import AutoPipelineForImage2Image, AutoPipelineForText2Image
+from app.model_catalog import SAMPLERS
 
 class DiffusersEngine:
     def __init__(self, model_id: str = "stabilityai/sdxl-turbo"):
@@ -21,6 +25,9 @@ class DiffusersEngine:
             except Exception:
                 pass
         self.pipe = None
+        self.img2img = None
+        self._default_scheduler = None
+        self._schedulers: Dict[str, object] = {}
 
     def _ensure_pipeline(self):
         if self.pipe is None:
@@ -43,17 +50,92 @@ class DiffusersEngine:
                 except Exception:
                     pass
             self.pipe = pipe
-        
-    def generate_image(self, prompt: str, negative: Optional[str], width: int, height: int, steps: int, cfg: float, seed: Optional[int]):
-        g = None
-        if seed is not None:
-            g = torch.Generator(device=self.device).manual_seed(seed)
-        
+            self._default_scheduler = pipe.scheduler
+
+    def _ensure_img2img(self):
         self._ensure_pipeline()
+        if self.img2img is None:
+            # Reutiliza los componentes ya cargados (sin recargar pesos)
+            self.img2img = AutoPipelineForImage2Image.from_pipe(self.pipe)
+
+    def _scheduler(self, sampler: Optional[str]):
+        """Scheduler para `sampler` creado con from_config sobre el del checkpoint
+        (conserva timestep_spacing, betas, etc.); no recarga pesos.
+        """
+        if sampler is None:
+            return self._default_scheduler
+        if sampler not in self._schedulers:
+            cls_name, overrides = SAMPLERS[sampler]
+            cls = getattr(diffusers, cls_name)
+            self._schedulers[sampler] = cls.from_config(self._default_scheduler.config, **overrides)
+        return self._schedulers[sampler]
+
+    def _autocast(self):
         # Autocast for performance (half / bf16) where it makes sense
         if self.device == "cuda" and self.dtype in (torch.float16, torch.bfloat16):
-            autocast_dtype = torch.bfloat16 if self.dtype == torch.bfloat16 else torch.float16
-            with torch.autocast(device_type="cuda", dtype=autocast_dtype):
+            return torch.autocast(device_type="cuda", dtype=self.dtype)
+        return nullcontext()
+
+    def _generator(self, seed: Optional[int]):
+        if seed is None:
+            return None
+        return torch.Generator(device=self.device).manual_seed(seed)
+
+    @torch.no_grad()
+    def _encode_prompt(self, prompt: str, negative: Optional[str], cfg: float) -> Dict[str, torch.Tensor]:
+        """Codifica el prompt una sola vez para poder reutilizarlo en refinados.
+        Con cfg <= 1 se omite la rama negativa.
+        """
+        out = self.pipe.encode_prompt(
+            prompt=prompt,
+            negative_prompt=negative,
+            device=self.device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=cfg > 1,
+        )
+        if len(out) == 4:  # SDXL: embeddings + pooled
+            names = ("prompt_embeds", "negative_prompt_embeds", "pooled_prompt_embeds", "negative_pooled_prompt_embeds")
+        else:
+            names = ("prompt_embeds", "negative_prompt_embeds")
+        return {k: v for k, v in zip(names, out) if v is not None}
+
+    @torch.no_grad()
+    def _decode_latents(self, latents: torch.Tensor):
+        vae = self.pipe.vae
+        # El VAE de SDXL desborda en fp16: decodificar en fp32 si el modelo lo pide
+        upcast = vae.dtype == torch.float16 and getattr(vae.config, "force_upcast", False)
+        if upcast:
+            vae.to(torch.float32)
+        try:
+            z = latents.to(device=vae.device, dtype=vae.dtype) / vae.config.scaling_factor
+            decoded = vae.decode(z, return_dict=False)[0]
+        finally:
+            if upcast:
+                vae.to(torch.float16)
+        return self.pipe.image_processor.postprocess(decoded, output_type="pil")[0]
+
+    @staticmethod
+    def _export_state(latents: torch.Tensor, embeds: Dict[str, torch.Tensor]) -> Dict:
+        # Copias compactas en CPU (fp16) para el caché de latents
+        state = {"latents": latents, **embeds}
+        return {k: v.detach().to("cpu", torch.float16).numpy() for k, v in state.items()}
+
+    def _import_state(self, state: Dict) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        tensors = {k: torch.from_numpy(v).to(self.device, self.dtype) for k, v in state.items()}
+        return tensors.pop("latents"), tensors
+
+    def generate_image(self, prompt: str, negative: Optional[str], width: int, height: int, steps: int, cfg: float, seed: Optional[int], return_latents: bool = False, sampler: Optional[str] = None):
+        """Genera una imagen. Con return_latents=True devuelve (imagen, estado) donde
+        el estado contiene latents finales y embeddings (arrays fp16) para refinar.
+        """
+        g = self._generator(seed)
+        self._ensure_pipeline()
+        self.pipe.scheduler = self._scheduler(sampler)
+        if cfg <= 1:
+            # Sin guidance: ni se codifica el negativo ni hay pasada incondicional de la UNet
+            negative = None
+        if not return_latents:
+            with self._autocast():
                 result = self.pipe(
                     prompt=prompt,
                     negative_prompt=negative,
@@ -63,14 +145,42 @@ class DiffusersEngine:
                     guidance_scale=cfg,
                     generator=g
                 )
-        else:
-            result = self.pipe(
-                prompt=prompt,
-                negative_prompt=negative,
+            return result.images[0]
+        embeds = self._encode_prompt(prompt, negative, cfg)
+        with self._autocast():
+            latents = self.pipe(
                 width=width,
                 height=height,
                 num_inference_steps=steps,
                 guidance_scale=cfg,
-                generator=g
-            )
-        return result.images[0]
\ No newline at end of file
+                generator=g,
+                output_type="latent",
+                **embeds
+            ).images
+        return self._decode_latents(latents), self._export_state(latents, embeds)
+
+    def refine_image(self, state: Dict, steps: int, cfg: float, seed: Optional[int], strength: float = 0.5, scale: float = 1.0, sampler: Optional[str] = None):
+        """Reanuda desde latents cacheados: hires-fix (scale > 1) y/o pasos extra de denoising.
+
+        Solo se ejecutan los últimos `steps * strength` pasos; los embeddings de texto
+        se reutilizan del estado. Devuelve (imagen, nuevo estado).
+        """
+        self._ensure_img2img()
+        self.img2img.scheduler = self._scheduler(sampler)
+        latents, embeds = self._import_state(state)
+        if cfg > 1 and "negative_prompt_embeds" not in embeds:
+            raise ValueError("cfg > 1 requires a source generation with cfg > 1")
+        if scale != 1.0:
+            h, w = latents.shape[-2:]
+            latents = F.interpolate(latents, size=(round(h * scale), round(w * scale)), mode="bilinear", align_corners=False)
+        with self._autocast():
+            refined = self.img2img(
+                image=latents,
+                strength=strength,
+                num_inference_steps=steps,
+                guidance_scale=cfg,
+                generator=self._generator(seed),
+                output_type="latent",
+                **embeds
+            ).images
+        return self._decode_latents(refined), self._export_state(refined, embeds)
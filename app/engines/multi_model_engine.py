@@ -1,60 +1,211 @@
-from collections import OrderedDict
-from typing import Dict
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Mapping, Optional
+import itertools
 import threading
-from app.engines.diffuser_engine import DiffusersEngine
-from app.config import DEFAULT_MODEL, ALLOWED_MODELS, MAX_MODELS_CACHE
+import time
+from app.config import DEFAULT_MODEL, ALLOWED_MODELS, MAX_MODELS_CACHE, replicas_for
+
+if TYPE_CHECKING:
+    from app.engines.diffuser_engine import DiffusersEngine
+
+
+def _diffusers_engine(model_id: str) -> "DiffusersEngine":
+    # Import diferido: torch/diffusers solo se cargan al crear el primer motor real
+    from app.engines.diffuser_engine import DiffusersEngine
+    return DiffusersEngine(model_id)
+
+
+class _ModelSlot:
+    """Estado de un modelo cargado: réplicas, semáforo de concurrencia y leases activos.
+
+    Cada réplica es un DiffusersEngine independiente; un lease toma una réplica en
+    exclusiva, de modo que un mismo pipeline (y su scheduler) nunca se ejecuta en dos
+    hilos a la vez.
+    """
+    def __init__(self, model_id: str, replicas: int, factory: Callable[[str], "DiffusersEngine"], last_used: int = 0):
+        self.model_id = model_id
+        self.replicas = replicas
+        self._free: List["DiffusersEngine"] = [factory(model_id) for _ in range(replicas)]
+        self._semaphore = threading.BoundedSemaphore(replicas)
+        self._cond = threading.Condition()
+        self.refs = 0          # leases registrados (en cola + en ejecución)
+        self.queued = 0        # esperando réplica libre
+        self.in_flight = 0     # ejecutando
+        self.max_queued = 0
+        self.leases_total = 0
+        self.retired = False
+        self.last_used = last_used
+
+    def acquire(self) -> Optional["DiffusersEngine"]:
+        """Registra un lease y espera una réplica libre. None si el slot ya fue retirado."""
+        with self._cond:
+            if self.retired:
+                return None
+            self.refs += 1
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        self._semaphore.acquire()
+        with self._cond:
+            self.queued -= 1
+            self.in_flight += 1
+            self.leases_total += 1
+            return self._free.pop()
+
+    def release(self, engine: "DiffusersEngine") -> None:
+        with self._cond:
+            self._free.append(engine)
+            self.in_flight -= 1
+        self._semaphore.release()
+        with self._cond:
+            self.refs -= 1
+            if self.refs == 0:
+                if self.retired:
+                    # Último usuario de un modelo desalojado: soltar pipelines
+                    self._free.clear()
+                self._cond.notify_all()
+
+    def retire(self, wait: bool = True, timeout: Optional[float] = None) -> bool:
+        """Marca el slot como retirado; opcionalmente espera a que terminen los leases.
+        Devuelve True si no quedan usuarios en vuelo.
+        """
+        with self._cond:
+            self.retired = True
+            if wait:
+                self._cond.wait_for(lambda: self.refs == 0, timeout=timeout)
+            drained = self.refs == 0
+            if drained:
+                self._free.clear()
+            return drained
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "replicas": self.replicas,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "leases_total": self.leases_total,
+            }
+
+
+class ModelHandle:
+    """Referencia ligera a un modelo del registro.
+
+    No retiene el pipeline: cada llamada a generate_image toma un lease, de modo que
+    una purga o un desalojo posteriores no se ven bloqueados por handles ociosos.
+    `service_seconds` guarda cuánto duró la última llamada con la réplica tomada,
+    sin la espera en cola (es lo que alimenta la estimación de admisión).
+    """
+    def __init__(self, registry: "MultiModelEngine", model_id: str):
+        self._registry = registry
+        self.model_id = model_id
+        self.service_seconds: Optional[float] = None
+
+    def _call(self, method: str, args, kwargs):
+        with self._registry.lease(self.model_id) as engine:
+            start = time.monotonic()
+            try:
+                return getattr(engine, method)(*args, **kwargs)
+            finally:
+                self.service_seconds = time.monotonic() - start
+
+    def generate_image(self, *args, **kwargs):
+        return self._call("generate_image", args, kwargs)
+
+    def refine_image(self, *args, **kwargs):
+        return self._call("refine_image", args, kwargs)
+
 
 class MultiModelEngine:
-    """Mantiene un caché LRU de pipelines DiffusersEngine por model_id."""
-    def __init__(self):
-        self._cache: OrderedDict[str, DiffusersEngine] = OrderedDict()
-        self._locks: Dict[str, threading.Lock] = {}
-        self._global_lock = threading.Lock()
+    """Registro LRU de pipelines DiffusersEngine por model_id.
 
-    def get(self, model_id: str | None) -> DiffusersEngine:
+    Lecturas sin lock: el mapa de modelos es un snapshot inmutable que solo se
+    reemplaza (copy-on-write) bajo `_write_lock`. Los leases llevan conteo de
+    referencias para que purga/desalojo esperen a los usuarios en vuelo, y cada
+    modelo limita su concurrencia al número de réplicas configurado.
+    """
+    def __init__(self, engine_factory: Callable[[str], "DiffusersEngine"] = _diffusers_engine):
+        self._factory = engine_factory
+        self._slots: Mapping[str, _ModelSlot] = MappingProxyType({})
+        self._write_lock = threading.Lock()
+        self._clock = itertools.count(1)
+
+    @staticmethod
+    def _resolve(model_id: str | None) -> str:
         mid = model_id or DEFAULT_MODEL
         if mid not in ALLOWED_MODELS:
             raise ValueError(f"Model '{mid}' not allowed")
-        # LRU hit
-        if mid in self._cache:
-            eng = self._cache.pop(mid)
-            self._cache[mid] = eng
-            return eng
-        # Double-checked locking per model
-        # Acquire (or create) a lock specific for this model id
-        with self._global_lock:
-            lock = self._locks.get(mid)
-            if lock is None:
-                lock = threading.Lock()
-                self._locks[mid] = lock
-        with lock:
-            # Re-check cache under lock (another thread may have loaded it)
-            if mid in self._cache:
-                eng2 = self._cache.pop(mid)
-                self._cache[mid] = eng2
-                return eng2
-            eng = DiffusersEngine(mid)
-            self._cache[mid] = eng
-            if len(self._cache) > MAX_MODELS_CACHE:
-                self._cache.popitem(last=False)
-            return eng
+        return mid
+
+    def _slot(self, mid: str) -> _ModelSlot:
+        # Fast path: lectura del snapshot actual, sin lock
+        slot = self._slots.get(mid)
+        if slot is not None:
+            return slot
+        evicted: List[_ModelSlot] = []
+        with self._write_lock:
+            slot = self._slots.get(mid)
+            if slot is not None:
+                return slot
+            # Sellado al crearse: un slot recién cargado y aún sin lease no es el LRU
+            slot = _ModelSlot(mid, replicas_for(mid), self._factory, last_used=next(self._clock))
+            slots = dict(self._slots)
+            slots[mid] = slot
+            while len(slots) > max(1, MAX_MODELS_CACHE):
+                lru = min((s for s in slots.values() if s is not slot), key=lambda s: s.last_used)
+                evicted.append(slots.pop(lru.model_id))
+            self._slots = MappingProxyType(slots)
+        # El desalojo no bloquea la carga: el último lease del slot libera los pipelines
+        for old in evicted:
+            old.retire(wait=False)
+        return slot
+
+    @contextmanager
+    def lease(self, model_id: str | None) -> Iterator["DiffusersEngine"]:
+        """Toma en exclusiva una réplica del modelo durante el bloque `with`."""
+        mid = self._resolve(model_id)
+        while True:
+            slot = self._slot(mid)
+            engine = slot.acquire()
+            if engine is not None:
+                break
+            # Slot retirado entre la lectura del snapshot y el registro: reintentar
+        slot.last_used = next(self._clock)
+        try:
+            yield engine
+        finally:
+            slot.release(engine)
+
+    def get(self, model_id: str | None) -> ModelHandle:
+        return ModelHandle(self, self._resolve(model_id))
 
     def list_models(self) -> Dict[str, Dict]:
-        return {m: {"loaded": m in self._cache} for m in ALLOWED_MODELS}
+        slots = self._slots
+        return {m: {"loaded": m in slots} for m in ALLOWED_MODELS}
+
+    def stats(self) -> Dict[str, Dict]:
+        """Estadísticas por modelo: réplicas, en vuelo y profundidad de cola."""
+        slots = self._slots
+        out: Dict[str, Dict] = {}
+        for m in ALLOWED_MODELS:
+            slot = slots.get(m)
+            out[m] = {"loaded": slot is not None, **(slot.stats() if slot else {})}
+        return out
 
-    def purge(self, model_id: str | None = None) -> Dict[str, int]:
+    def purge(self, model_id: str | None = None, timeout: Optional[float] = None) -> Dict[str, int]:
         """Purga el caché completo o un modelo específico.
+        Espera (hasta `timeout`) a que terminen las generaciones en vuelo.
         Devuelve métricas simples: {'removed': n, 'remaining': k}
         """
-        removed = 0
-        if model_id:
-            if model_id in self._cache:
-                try:
-                    self._cache.pop(model_id)
-                    removed = 1
-                except KeyError:
-                    pass
-        else:
-            removed = len(self._cache)
-            self._cache.clear()
-        return {"removed": removed, "remaining": len(self._cache)}
+        with self._write_lock:
+            slots = dict(self._slots)
+            if model_id:
+                removed_slots = [slots.pop(model_id)] if model_id in slots else []
+            else:
+                removed_slots = list(slots.values())
+                slots.clear()
+            self._slots = MappingProxyType(slots)
+        for slot in removed_slots:
+            slot.retire(wait=True, timeout=timeout)
+        return {"removed": len(removed_slots), "remaining": len(slots)}
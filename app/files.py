@@ -0,0 +1,117 @@
+import os
+import re
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.config import IMAGES_DIR, FILES_THUMB_WIDTHS, FILES_ACCEL_REDIRECT_PREFIX
+from app.storage import etag_for, path_for, thumbnail_path_for
+
+# Los image_id son write-once: cualquier URL /files/ es inmutable
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+_FILENAME_RE = re.compile(r"^(?P<image_id>[A-Za-z0-9_-]+)\.png$")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+router = APIRouter()
+
+
+class ImmutableFileResponse(Response):
+    """Envía un fichero (o un rango) usando sendfile si el servidor ASGI lo soporta
+    (extensión `http.response.zerocopysend`) y lectura por bloques en otro caso.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, start: int, length: int, status_code: int, headers: dict, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type="image/png")
+        self.path = path
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f.fileno(), "offset": self.start, "count": self.length})
+            return
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # Fichero truncado bajo nuestros pies: cerrar el cuerpo igualmente
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Rango único `bytes=a-b` -> (inicio, fin inclusivo). None = ignorar (servir completo).
+    Lanza 416 si el rango no es satisfacible.
+    """
+    m = _RANGE_RE.match(header.strip())
+    if not m or m.group(1) == m.group(2) == "":
+        return None  # multi-rango o sintaxis desconocida: se ignora según RFC 9110
+    first, last = m.group(1), m.group(2)
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if not header.strip() or not etag:
+        return False
+    return header.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in header.split(",")]
+
+
+@router.api_route("/files/{filename}", methods=["GET", "HEAD"], include_in_schema=False)
+def serve_file(filename: str, request: Request, w: Optional[int] = None):
+    m = _FILENAME_RE.match(filename)
+    if not m:
+        raise HTTPException(404, "Not Found")
+    image_id = m.group("image_id")
+    path = path_for(image_id)
+    if not os.path.isfile(path):
+        raise HTTPException(404, "Not Found")
+    if w is not None:
+        if w not in FILES_THUMB_WIDTHS:
+            raise HTTPException(400, f"Thumbnail width must be one of {FILES_THUMB_WIDTHS}")
+        path = thumbnail_path_for(image_id, w)
+
+    etag = etag_for(path)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    if FILES_ACCEL_REDIRECT_PREFIX:
+        # Zero-copy delegado al proxy (nginx resuelve rangos y sendfile)
+        rel = os.path.relpath(path, os.path.dirname(IMAGES_DIR))
+        headers["X-Accel-Redirect"] = f"{FILES_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{rel}"
+        return Response(status_code=200, headers=headers, media_type="image/png")
+
+    size = os.path.getsize(path)
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return ImmutableFileResponse(path, start, end - start + 1, status_code, headers, send_body=request.method != "HEAD")
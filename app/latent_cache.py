@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import LATENT_CACHE_SIZE, LATENT_CACHE_DISK_SIZE, LATENTS_DIR
+
+# Environment variables:
+# LATENT_CACHE_SIZE (default 0 -> disabled): entradas retenidas en RAM
+# LATENT_CACHE_DISK_SIZE (default 0 -> sin spill): entradas desalojadas que se guardan en disco
+
+_META_KEY = "__meta__"
+
+LatentState = Dict[str, Any]  # nombre -> np.ndarray float16 (latents y embeddings de texto)
+
+
+class LatentCache:
+    """LRU de latents finales por image_id, con spill opcional a disco (.npz fp16).
+
+    Cada entrada guarda los latents de salida y los embeddings de texto de la
+    generación, de modo que un refinado posterior no repite ni la codificación del
+    prompt ni los primeros pasos de difusión.
+    """
+    def __init__(self, max_entries: int, disk_dir: Optional[str] = None, max_disk_entries: int = 0):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir if max_disk_entries > 0 else None
+        self.max_disk_entries = max_disk_entries
+        self._ram: "OrderedDict[str, Tuple[LatentState, Dict[str, Any]]]" = OrderedDict()
+        self._disk: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # Reindexar spills de procesos anteriores (más antiguos primero)
+            files = [f for f in os.listdir(self.disk_dir) if f.endswith(".npz")]
+            files.sort(key=lambda f: os.path.getmtime(os.path.join(self.disk_dir, f)))
+            for f in files:
+                self._disk[f[:-4]] = os.path.join(self.disk_dir, f)
+
+    def put(self, image_id: str, state: LatentState, meta: Dict[str, Any]) -> None:
+        with self._lock:
+            self._ram[image_id] = (state, meta)
+            self._ram.move_to_end(image_id)
+            evicted = []
+            while len(self._ram) > self.max_entries:
+                evicted.append(self._ram.popitem(last=False))
+        # Escritura a disco fuera del lock
+        for eid, (est, emeta) in evicted:
+            self._spill(eid, est, emeta)
+
+    def get(self, image_id: str) -> Optional[Tuple[LatentState, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._ram.get(image_id)
+            if entry is not None:
+                self._ram.move_to_end(image_id)
+                return entry
+            path = self._disk.get(image_id)
+        if path is None:
+            return None
+        try:
+            entry = _load_npz(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self._disk.pop(image_id, None)
+            return None
+        # Promocionar a RAM (el fichero se conserva para futuros desalojos)
+        self.put(image_id, *entry)
+        return entry
+
+    def __contains__(self, image_id: str) -> bool:
+        with self._lock:
+            return image_id in self._ram or image_id in self._disk
+
+    def _spill(self, image_id: str, state: LatentState, meta: Dict[str, Any]) -> None:
+        if not self.disk_dir:
+            return
+        with self._lock:
+            if image_id in self._disk:
+                self._disk.move_to_end(image_id)
+                return
+        import numpy as np  # dependencia de la pila ML; import diferido
+        path = os.path.join(self.disk_dir, f"{image_id}.npz")
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **{_META_KEY: np.array(json.dumps(meta))}, **{k: np.asarray(v, dtype=np.float16) for k, v in state.items()})
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk[image_id] = path
+            stale = []
+            while len(self._disk) > self.max_disk_entries:
+                stale.append(self._disk.popitem(last=False)[1])
+        for p in stale:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+def _load_npz(path: str) -> Tuple[LatentState, Dict[str, Any]]:
+    import numpy as np
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data[_META_KEY]))
+        state = {k: data[k] for k in data.files if k != _META_KEY}
+    return state, meta
+
+
+_cache: Optional[LatentCache] = None
+_cache_lock = threading.Lock()
+
+
+def latent_cache_enabled() -> bool:
+    return LATENT_CACHE_SIZE > 0
+
+
+def get_latent_cache() -> Optional[LatentCache]:
+    """Caché global del proceso (None si LATENT_CACHE_SIZE <= 0)."""
+    global _cache
+    if not latent_cache_enabled():
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LatentCache(LATENT_CACHE_SIZE, LATENTS_DIR, LATENT_CACHE_DISK_SIZE)
+    return _cache
@@ -0,0 +1,261 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import DATA_DIR
+
+# Environment variables:
+# LEDGER_ENABLED (default: 1) -> registrar cada generación en DATA_DIR/ledger.sqlite3
+# LEDGER_PATH (opcional) -> ruta alternativa de la base de datos
+
+def ledger_enabled() -> bool:
+    return os.getenv("LEDGER_ENABLED", "1").lower() not in ("0", "false", "no")
+
+
+def ledger_path() -> str:
+    return os.getenv("LEDGER_PATH") or os.path.join(DATA_DIR, "ledger.sqlite3")
+
+
+COLUMNS = (
+    "image_id", "created_at", "kind", "status", "model", "prompt", "negative_prompt",
+    "width", "height", "steps", "cfg", "sampler", "seed", "parent_id",
+    "project_id", "agent_id", "duration_sec", "error", "request_json",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_id TEXT UNIQUE,
+    created_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    model TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    width INTEGER,
+    height INTEGER,
+    steps INTEGER,
+    cfg REAL,
+    sampler TEXT,
+    seed INTEGER,
+    parent_id TEXT,
+    project_id TEXT,
+    agent_id TEXT,
+    duration_sec REAL,
+    error TEXT,
+    request_json TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_generations_created ON generations (created_at);
+CREATE INDEX IF NOT EXISTS ix_generations_project ON generations (project_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_generations_agent ON generations (agent_id, created_at);
+"""
+_INSERT = f"INSERT OR IGNORE INTO generations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})"
+
+
+class LedgerUnavailable(Exception):
+    """La base de datos del ledger no se pudo abrir o inicializar."""
+
+
+class Ledger:
+    """Registro append-only de peticiones/resultados en SQLite (WAL).
+
+    `record()` no bloquea: encola el registro y un hilo escritor lo inserta en lotes
+    (hasta `batch_size` registros o cada `flush_interval` segundos), fuera del camino
+    de la petición. La apertura y el esquema también se hacen en el hilo escritor:
+    si fallan (DATA_DIR sin permisos, base bloqueada...) el ledger queda desactivado
+    y descarta registros en lugar de propagar el error a las generaciones.
+    """
+    def __init__(self, path: str, batch_size: int = 64, flush_interval: float = 0.5, max_pending: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        self.error: Optional[str] = None
+        self._ready = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._writer.start()
+
+    def _init_db(self, attempts: int = 3) -> sqlite3.Connection:
+        # Varios workers pueden crear el esquema a la vez: reintentar si está bloqueada
+        for attempt in range(attempts):
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                conn = self._connect()
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                except sqlite3.Error:
+                    conn.close()
+                    raise
+                return conn
+            except (sqlite3.Error, OSError):
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.2 * (attempt + 1))
+        raise AssertionError("unreachable")
+
+    def _require_ready(self, timeout: float = 5.0) -> None:
+        if not self._ready.wait(timeout) or self.error is not None:
+            raise LedgerUnavailable(self.error or "ledger not ready")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        if self.error is not None:
+            self.dropped += 1
+            return
+        row = dict(entry)
+        row.setdefault("created_at", time.time())
+        try:
+            self._queue.put_nowait(tuple(row.get(c) for c in COLUMNS))
+        except queue.Full:
+            # Nunca frenar una generación por el ledger
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Espera a que el escritor persista todo lo encolado hasta ahora."""
+        if self._closed or not self._writer.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            conn = self._init_db()
+        except (sqlite3.Error, OSError) as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logging.getLogger("uvicorn.error").error("ledger.unavailable", extra={"path": self.path, "error": self.error})
+            self._ready.set()
+            # Liberar a quien espere un flush; lo encolado se descarta
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is not None:
+                    self.dropped += 1
+        self._ready.set()
+        try:
+            while True:
+                item = self._queue.get()
+                batch, events, stop = [], [], False
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is None:
+                        stop = True
+                    elif isinstance(item, threading.Event):
+                        events.append(item)
+                    else:
+                        batch.append(item)
+                    if stop or events or len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                if batch:
+                    try:
+                        with conn:
+                            conn.executemany(_INSERT, batch)
+                    except sqlite3.Error:
+                        self.dropped += len(batch)
+                for ev in events:
+                    ev.set()
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def get(self, image_id: str) -> Optional[Dict[str, Any]]:
+        self._require_ready()
+        row = self._get(image_id)
+        if row is None and self.flush(timeout=1.0):
+            # Puede estar aún en el lote pendiente
+            row = self._get(image_id)
+        return row
+
+    def _get(self, image_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM generations WHERE image_id = ?", (image_id,)).fetchone()
+        finally:
+            conn.close()
+        return _row_to_dict(row) if row is not None else None
+
+    def query(self, project_id: Optional[str] = None, agent_id: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None, status: Optional[str] = None, kind: Optional[str] = None,
+              model: Optional[str] = None, exclude_agent_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Registros más recientes primero, filtrados por los campos indexados."""
+        self._require_ready()
+        clauses, args = [], []
+        for col, value in (("project_id", project_id), ("agent_id", agent_id), ("status", status), ("kind", kind), ("model", model)):
+            if value is not None:
+                clauses.append(f"{col} = ?")
+                args.append(value)
+        if exclude_agent_id is not None:
+            clauses.append("(agent_id IS NULL OR agent_id != ?)")
+            args.append(exclude_agent_id)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            args.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT {', '.join(COLUMNS)} FROM generations {where} ORDER BY created_at DESC LIMIT ?"
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, (*args, limit)).fetchall()
+        finally:
+            conn.close()
+        return [_row_to_dict(r) for r in rows]
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    out = dict(row)
+    raw = out.pop("request_json", None)
+    out["request"] = json.loads(raw) if raw else None
+    return out
+
+
+_ledger: Optional[Ledger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> Optional[Ledger]:
+    """Ledger global del proceso (None si LEDGER_ENABLED=0)."""
+    global _ledger
+    if not ledger_enabled():
+        return None
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = Ledger(ledger_path())
+                atexit.register(_ledger.close)
+    return _ledger
@@ -0,0 +1,145 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+from app.config import replicas_for
+
+
+class Rejected(Exception):
+    """Petición rechazada antes de empezar a generar (se traduce a 503 + Retry-After)."""
+    def __init__(self, reason: str, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = max(1, retry_after)
+
+
+class Ticket:
+    """Plaza admitida; `completed()` alimenta la estimación, `release()` libera la plaza.
+
+    `completed()` debe recibir el tiempo de servicio (réplica tomada): la espera en
+    cola ya la cuenta `admit()` con `waves`. Sin él se usa el tiempo desde la admisión.
+    """
+    def __init__(self, controller: "AdmissionController", model: str):
+        self._controller = controller
+        self.model = model
+        self.start = time.monotonic()
+        self._released = False
+
+    def completed(self, service_seconds: Optional[float] = None) -> None:
+        if service_seconds is None:
+            service_seconds = time.monotonic() - self.start
+        self._controller._observe(self.model, service_seconds)
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self.model)
+
+
+class AdmissionController:
+    """Control de admisión: modo drenaje y descarte de carga por espera estimada.
+
+    La duración de cada modelo se estima con una media móvil exponencial de las
+    generaciones completadas; con `n` peticiones ya en vuelo y `r` réplicas, una
+    nueva terminaría en aproximadamente `(n // r + 1) * duración`.
+
+    Solo se descarta si hay cola (`n >= r`): con réplicas libres no hay espera que
+    estimar. La primera generación de cada modelo (carga de pesos) no entra en la
+    media, cada muestra puede como mucho multiplicar la media por `max_growth`, y
+    una media sin muestras nuevas en `stale_after` segundos caduca, de modo que el
+    controlador no puede quedarse rechazándolo todo indefinidamente.
+    """
+    def __init__(self, alpha: float = 0.2, drain_retry_after: int = 10, stale_after: float = 60.0, max_growth: float = 3.0):
+        self.alpha = alpha
+        self.drain_retry_after = drain_retry_after
+        self.stale_after = stale_after
+        self.max_growth = max_growth
+        self.draining = False
+        self._cond = threading.Condition()
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._ewma: Dict[str, float] = {}
+        self._observed_at: Dict[str, float] = {}
+        self._warm: Set[str] = set()
+
+    def _duration(self, model: str) -> Optional[float]:
+        """Duración media vigente (None sin historial o si ha caducado). Requiere el lock."""
+        duration = self._ewma.get(model)
+        if duration is None or time.monotonic() - self._observed_at[model] > self.stale_after:
+            return None
+        return duration
+
+    def estimated_completion(self, model: str) -> Optional[float]:
+        """Segundos hasta que terminaría una petición nueva (None sin historial)."""
+        with self._cond:
+            duration = self._duration(model)
+            if duration is None:
+                return None
+            return (self._in_flight[model] // replicas_for(model) + 1) * duration
+
+    def admit(self, model: str, deadline_ms: Optional[int] = None, timeout_sec: float = 0) -> Ticket:
+        with self._cond:
+            if self.draining:
+                raise Rejected("draining", "Service is draining, retry on another instance", self.drain_retry_after)
+            duration = self._duration(model)
+            waves = self._in_flight[model] // replicas_for(model)
+            if duration is not None and waves > 0:
+                estimate = (waves + 1) * duration
+                # Reintentar cuando se haya vaciado la cola actual
+                retry_after = math.ceil(waves * duration)
+                if deadline_ms is not None and estimate * 1000 > deadline_ms:
+                    raise Rejected("deadline", f"Estimated completion {estimate:.1f}s exceeds deadline {deadline_ms}ms", retry_after)
+                if timeout_sec and timeout_sec > 0 and estimate > timeout_sec:
+                    raise Rejected("overload", f"Estimated completion {estimate:.1f}s exceeds generation timeout {timeout_sec}s", retry_after)
+            self._in_flight[model] += 1
+        return Ticket(self, model)
+
+    def _observe(self, model: str, seconds: float) -> None:
+        with self._cond:
+            if model not in self._warm:
+                # Primera generación: incluye la carga perezosa del pipeline
+                self._warm.add(model)
+                return
+            prev = self._duration(model)
+            if prev is None:
+                self._ewma[model] = seconds
+            else:
+                sample = min(seconds, prev * self.max_growth)
+                self._ewma[model] = prev + self.alpha * (sample - prev)
+            self._observed_at[model] = time.monotonic()
+
+    def _release(self, model: str) -> None:
+        with self._cond:
+            self._in_flight[model] -= 1
+            if self.in_flight == 0:
+                self._cond.notify_all()
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def start_drain(self) -> None:
+        with self._cond:
+            self.draining = True
+
+    def stop_drain(self) -> None:
+        with self._cond:
+            self.draining = False
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que terminen las generaciones en vuelo. True si quedó vacío."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.in_flight == 0, timeout=timeout)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "draining": self.draining,
+                "in_flight": self.in_flight,
+                "models": {
+                    m: {"in_flight": self._in_flight.get(m, 0), "avg_duration_sec": round(d, 3), "stale": self._duration(m) is None}
+                    for m, d in self._ewma.items()
+                },
+            }
@@ -1,44 +1,119 @@
-from typing import Dict
-from fastapi import FastAPI, HTTPException, Depends
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi import Body
+from fastapi.responses import JSONResponse
 import time
 from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import logging
 import random
-from fastapi.staticfiles import StaticFiles
 
-from app.engines.diffuser_engine import DiffusersEngine
-from app.engines.multi_model_engine import MultiModelEngine
+from app.engines.multi_model_engine import ModelHandle, MultiModelEngine
 
-from .models import GenerateRequest, HealthStatus, ImageItem, ImageModelInfo, JobStatus
-from .storage import new_image_id, save_placeholder, url_for, path_for
-from .config import IMAGES_DIR, DEFAULT_MODEL, ALLOWED_MODELS, generation_timeout_seconds
+from .models import GenerateRequest, HealthStatus, ImageItem, JobStatus, RefineRequest
+from .storage import new_image_id, save_image, url_for
+from .files import router as files_router
+from .config import DEFAULT_MODEL, ALLOWED_MODELS, DRAIN_RETRY_AFTER_SECONDS, generation_timeout_seconds
 from .auth import AuthDependency
-from .metrics import record_generation, prometheus_exposition_body, prometheus_content_type, metrics_enabled
+from .metrics import record_generation, record_rejection, prometheus_exposition_body, prometheus_content_type, metrics_enabled
+from .latent_cache import get_latent_cache
+from .model_catalog import SAMPLERS, model_info, sampler_names
+from .ledger import LedgerUnavailable, get_ledger
+from .lifecycle import AdmissionController, Rejected, Ticket
+from .profiling import Profiler, ProfileBusy
 
-app = FastAPI(title="Image Generation Service", version="0.1.0")
-# Static files: align mount path with url_for() helper returning /files/<id>.png
-app.mount("/files", StaticFiles(directory=IMAGES_DIR), name="files")
+_ADMISSION = AdmissionController(drain_retry_after=DRAIN_RETRY_AFTER_SECONDS)
+_PROFILER = Profiler()
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Abrir el ledger al arrancar (el esquema se crea en su hilo escritor)
+    get_ledger()
+    yield
+    # uvicorn ejecuta este apagado cuando ya cerró los sockets y esperó a las
+    # peticiones en vuelo (--timeout-graceful-shutdown): el drenaje ocurre antes,
+    # desde el preStop vía /v1/admin/drain
+    ledger = get_ledger()
+    if ledger is not None:
+        ledger.close()
+
+
+app = FastAPI(title="Image Generation Service", version="0.1.0", lifespan=lifespan)
+# Ficheros: /files/<id>.png (url_for) con caché inmutable, ETag, rangos y miniaturas
+app.include_router(files_router)
 _MULTI_ENGINE: MultiModelEngine | None = None
 
-def get_engine(model_id: str | None = None) -> DiffusersEngine:
+def get_engine(model_id: str | None = None) -> ModelHandle:
     global _MULTI_ENGINE
     if _MULTI_ENGINE is None:
         _MULTI_ENGINE = MultiModelEngine()
     return _MULTI_ENGINE.get(model_id)
 
 
+def _admit(model: str, deadline_ms: Optional[int]) -> Ticket:
+    """Admisión previa a generar: 503 + Retry-After si drenando o si no se llegaría a tiempo."""
+    try:
+        return _ADMISSION.admit(model, deadline_ms=deadline_ms, timeout_sec=generation_timeout_seconds())
+    except Rejected as e:
+        logging.getLogger("uvicorn.error").warning("generation.rejected", extra={"model": model, "reason": e.reason, "retry_after": e.retry_after})
+        record_rejection(e.reason, model)
+        raise HTTPException(status_code=503, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+
+def _ledger_record(**fields):
+    """Encola un registro en el ledger (no bloquea la petición).
+
+    Un fallo del ledger nunca convierte una generación correcta en un error.
+    """
+    try:
+        ledger = get_ledger()
+        if ledger is not None:
+            ledger.record(fields)
+    except Exception as e:
+        logging.getLogger("uvicorn.error").error("ledger.record_failed", extra={"error": str(e)})
+
+
+def _run_with_timeout(fn, model: str, seed: int):
+    """Ejecuta fn aplicando GENERATION_TIMEOUT_SECONDS (504 si se excede)."""
+    timeout_sec = generation_timeout_seconds()
+    if timeout_sec and timeout_sec > 0:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fn)
+            try:
+                return future.result(timeout=timeout_sec)
+            except TimeoutError:
+                logging.getLogger("uvicorn.error").error("generation.timeout", extra={
+                    "model": model,
+                    "seed": seed,
+                    "timeout_sec": timeout_sec
+                })
+                raise HTTPException(status_code=504, detail="Generation timeout exceeded")
+    return fn()
+
+
 @app.get("/health", response_model=HealthStatus)
 def health():
     return HealthStatus()
 
+@app.get("/ready", response_model=HealthStatus)
+def ready():
+    """Readiness: 503 mientras el servicio drena, para que el balanceador deje de enviar tráfico."""
+    if _ADMISSION.draining:
+        return JSONResponse(status_code=503, content=HealthStatus(status="draining").model_dump())
+    return HealthStatus()
+
 @app.get("/v1/models")
 def image_models(_: None = AuthDependency):
-    models = [
-        ImageModelInfo(name=m, family="sdxl", min_vram_gb=8.0, resolution="best@1024", tag=["multi-model"]).model_dump()
-        for m in ALLOWED_MODELS
-    ]
-    return {"default_model": DEFAULT_MODEL, "models": models}
+    models = [model_info(m).model_dump() for m in ALLOWED_MODELS]
+    return {"default_model": DEFAULT_MODEL, "samplers": sampler_names(), "models": models}
+
+@app.get("/v1/models/stats")
+def image_models_stats(_: None = AuthDependency):
+    """Estado en caliente del registro: réplicas, generaciones en vuelo y cola por modelo."""
+    if _MULTI_ENGINE is None:
+        return {"models": {m: {"loaded": False} for m in ALLOWED_MODELS}}
+    return {"models": _MULTI_ENGINE.stats()}
 
 @app.post("/v1/generate", response_model=JobStatus)
 def generate(req: GenerateRequest, _: None = AuthDependency):
@@ -47,10 +122,20 @@ def generate(req: GenerateRequest, _: None = AuthDependency):
         raise HTTPException(400, "Prompt cannot be empty")
     if(req.params.width > 2048 or req.params.height > 2048):
         raise HTTPException(400, "Max size is 2048x2048")
-    if req.params.steps > 100 or req.params.cfg > 20:
+    # Selección de modelo y valores recomendados para steps/cfg no especificados
+    selected_model = req.params.model or DEFAULT_MODEL
+    if selected_model not in ALLOWED_MODELS:
+        raise HTTPException(400, f"Model '{selected_model}' not allowed")
+    info = model_info(selected_model)
+    steps = req.params.steps if req.params.steps is not None else info.recommended_steps
+    cfg = req.params.cfg if req.params.cfg is not None else info.recommended_cfg
+    if steps > 100 or cfg > 20:
         raise HTTPException(400, "Steps/CFG exceed allowed limits")
     if req.params.width % 8 != 0 or req.params.height % 8 != 0:
         raise HTTPException(400, "Width and height must be multiples of 8")
+    sampler = req.params.sampler
+    if sampler is not None and sampler not in SAMPLERS:
+        raise HTTPException(400, f"Unknown sampler '{sampler}'. Available: {', '.join(SAMPLERS)}")
     
     # Negative prompt por defecto (saneado)
     negative = req.negative_prompt or "low quality, bad anatomy, nsfw, watermark"
@@ -58,44 +143,65 @@ def generate(req: GenerateRequest, _: None = AuthDependency):
     # Seed: generar si no se especifica
     seed = req.params.seed if req.params.seed is not None else random.randint(0, 2**32 - 1)
     
+    ledger_fields = {
+        "kind": "generate",
+        "model": selected_model,
+        "prompt": req.prompt.strip(),
+        "negative_prompt": negative,
+        "width": req.params.width,
+        "height": req.params.height,
+        "steps": steps,
+        "cfg": cfg,
+        "sampler": sampler,
+        "seed": seed,
+        "project_id": req.metadata.project_id,
+        "agent_id": req.metadata.agent_id,
+        "request_json": req.model_dump_json(),
+    }
+
     # Generar imagen
+    ticket = _admit(selected_model, req.deadline_ms)
+    track = _PROFILER.begin("generate", selected_model)
     logger = logging.getLogger("uvicorn.error")
     start = time.time()
     try:
-        # Selección de modelo
-        selected_model = req.params.model or DEFAULT_MODEL
-        if selected_model not in ALLOWED_MODELS:
-            raise HTTPException(400, f"Model '{selected_model}' not allowed")
+        latent_cache = get_latent_cache()
+        engine = get_engine(selected_model)
         def _do_generate():
-            return get_engine(selected_model).generate_image(
+            # Solo se pasan los extras activos (motores simples no los aceptan)
+            kwargs = {}
+            if latent_cache is not None:
+                kwargs["return_latents"] = True
+            if sampler is not None:
+                kwargs["sampler"] = sampler
+            return engine.generate_image(
                 prompt=req.prompt.strip(),
                 negative=negative,
                 width=req.params.width,
                 height=req.params.height,
-                steps=req.params.steps,
-                cfg=req.params.cfg,
-                seed=seed)
-
-        timeout_sec = generation_timeout_seconds()
-        if timeout_sec and timeout_sec > 0:
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(_do_generate)
-                try:
-                    image = future.result(timeout=timeout_sec)
-                except TimeoutError:
-                    logger.error("generation.timeout", extra={
-                        "model": selected_model,
-                        "seed": seed,
-                        "timeout_sec": timeout_sec
-                    })
-                    raise HTTPException(status_code=504, detail="Generation timeout exceeded")
-        else:
-            image = _do_generate()
+                steps=steps,
+                cfg=cfg,
+                seed=seed,
+                **kwargs)
+
+        result = _run_with_timeout(track.wrap(_do_generate), selected_model, seed)
+        image, state = result if latent_cache is not None else (result, None)
 
         # Guardar imagen
         image_id = new_image_id()
-        img_path = path_for(image_id)
-        image.save(img_path, format="PNG")
+        save_image(image_id, image)
+        if state is not None:
+            latent_cache.put(image_id, state, {
+                "model": selected_model,
+                "prompt": req.prompt.strip(),
+                "negative": negative,
+                "width": req.params.width,
+                "height": req.params.height,
+                "steps": steps,
+                "cfg": cfg,
+                "sampler": sampler,
+                "seed": seed,
+            })
 
         item = ImageItem(image_id=image_id, url=url_for(image_id), seed=seed)
         duration = round(time.time() - start, 3)
@@ -103,16 +209,27 @@ def generate(req: GenerateRequest, _: None = AuthDependency):
             "prompt_len": len(req.prompt.strip()),
             "width": req.params.width,
             "height": req.params.height,
-            "steps": req.params.steps,
-            "cfg": req.params.cfg,
+            "steps": steps,
+            "cfg": cfg,
+            "sampler": sampler,
             "seed": seed,
             "model": selected_model,
             "duration_sec": duration,
             "status": "completed"
         })
         record_generation("completed", selected_model, duration)
-        return JobStatus(status="completed", images=[item], audit={"policy":"standard", "model": selected_model, "duration_sec": str(duration)})
-    except HTTPException:
+        # Solo el tiempo con la réplica tomada (los motores simples no lo exponen)
+        ticket.completed(getattr(engine, "service_seconds", None))
+        _ledger_record(image_id=image_id, status="completed", duration_sec=duration, **ledger_fields)
+        audit = {"policy": "standard", "model": selected_model, "steps": str(steps), "cfg": str(cfg), "duration_sec": str(duration)}
+        if sampler is not None:
+            audit["sampler"] = sampler
+        if track.session is not None:
+            audit["profile"] = track.session.id
+        return JobStatus(status="completed", images=[item], audit=audit)
+    except HTTPException as e:
+        if e.status_code == 504:
+            _ledger_record(status="timeout", duration_sec=round(time.time() - start, 3), error=e.detail, **ledger_fields)
         # Re-lanzar para que FastAPI maneje correctamente el código de estado
         raise
     except Exception as e:  # broad catch to return structured error (500)
@@ -121,16 +238,199 @@ def generate(req: GenerateRequest, _: None = AuthDependency):
             "error": str(e),
             "duration_sec": duration,
             "seed": seed,
-            "model": req.params.model or DEFAULT_MODEL
+            "model": selected_model
         })
-        record_generation("failed", req.params.model or DEFAULT_MODEL, duration)
+        record_generation("failed", selected_model, duration)
+        _ledger_record(status="failed", duration_sec=duration, error=str(e), **ledger_fields)
         raise HTTPException(status_code=500, detail="Internal generation error")
+    finally:
+        track.end()
+        ticket.release()
+
+@app.post("/v1/refine", response_model=JobStatus)
+def refine(req: RefineRequest, _: None = AuthDependency):
+    """Re-renderiza una imagen previa desde sus latents cacheados (hires-fix y/o pasos extra)."""
+    latent_cache = get_latent_cache()
+    if latent_cache is None:
+        raise HTTPException(400, "Latent cache disabled (set LATENT_CACHE_SIZE)")
+    entry = latent_cache.get(req.image_id)
+    if entry is None:
+        raise HTTPException(404, f"No cached latents for image '{req.image_id}'")
+    state, meta = entry
+    p = req.params
+    if p.steps * p.strength < 1:
+        raise HTTPException(400, "steps * strength must be >= 1")
+    # Dimensiones finales: la escala se aplica sobre el latent (1/8 de la resolución)
+    width = round(meta["width"] // 8 * p.scale) * 8
+    height = round(meta["height"] // 8 * p.scale) * 8
+    if width > 2048 or height > 2048:
+        raise HTTPException(400, "Max size is 2048x2048")
+    model = meta["model"]
+    if model not in ALLOWED_MODELS:
+        raise HTTPException(400, f"Model '{model}' not allowed")
+    cfg = p.cfg if p.cfg is not None else meta["cfg"]
+    seed = p.seed if p.seed is not None else meta["seed"]
+    sampler = p.sampler if p.sampler is not None else meta.get("sampler")
+    if sampler is not None and sampler not in SAMPLERS:
+        raise HTTPException(400, f"Unknown sampler '{sampler}'. Available: {', '.join(SAMPLERS)}")
+    if cfg > 1 and meta["cfg"] <= 1:
+        # La generación original no codificó la rama negativa
+        raise HTTPException(400, "cfg > 1 requires a source generation with cfg > 1")
+
+    ledger_fields = {
+        "kind": "refine",
+        "model": model,
+        "prompt": meta.get("prompt"),
+        "negative_prompt": meta.get("negative"),
+        "width": width,
+        "height": height,
+        "steps": p.steps,
+        "cfg": cfg,
+        "sampler": sampler,
+        "seed": seed,
+        "parent_id": req.image_id,
+        "request_json": req.model_dump_json(),
+    }
+    ticket = _admit(model, req.deadline_ms)
+    track = _PROFILER.begin("refine", model)
+    logger = logging.getLogger("uvicorn.error")
+    start = time.time()
+    try:
+        engine = get_engine(model)
+        def _do_refine():
+            kwargs = {"sampler": sampler} if sampler is not None else {}
+            return engine.refine_image(
+                state, steps=p.steps, cfg=cfg, seed=seed, strength=p.strength, scale=p.scale, **kwargs)
+
+        image, new_state = _run_with_timeout(track.wrap(_do_refine), model, seed)
+        image_id = new_image_id()
+        save_image(image_id, image)
+        latent_cache.put(image_id, new_state, {
+            **meta, "width": width, "height": height, "steps": p.steps, "cfg": cfg, "sampler": sampler, "seed": seed, "parent": req.image_id,
+        })
+        duration = round(time.time() - start, 3)
+        logger.info("refine.completed", extra={
+            "parent": req.image_id,
+            "width": width,
+            "height": height,
+            "steps": p.steps,
+            "strength": p.strength,
+            "seed": seed,
+            "model": model,
+            "duration_sec": duration,
+        })
+        record_generation("completed", model, duration)
+        # Solo el tiempo con la réplica tomada (los motores simples no lo exponen)
+        ticket.completed(getattr(engine, "service_seconds", None))
+        _ledger_record(image_id=image_id, status="completed", duration_sec=duration, **ledger_fields)
+        item = ImageItem(image_id=image_id, url=url_for(image_id), seed=seed)
+        return JobStatus(status="completed", images=[item], audit={"policy": "standard", "model": model, "parent": req.image_id, "duration_sec": str(duration)})
+    except HTTPException as e:
+        if e.status_code == 504:
+            _ledger_record(status="timeout", duration_sec=round(time.time() - start, 3), error=e.detail, **ledger_fields)
+        raise
+    except Exception as e:
+        duration = round(time.time() - start, 3)
+        logger.error("refine.failed", extra={"error": str(e), "parent": req.image_id, "model": model, "duration_sec": duration})
+        record_generation("failed", model, duration)
+        _ledger_record(status="failed", duration_sec=duration, error=str(e), **ledger_fields)
+        raise HTTPException(status_code=500, detail="Internal generation error")
+    finally:
+        track.end()
+        ticket.release()
+
+@app.get("/v1/images/{image_id}")
+def image_metadata(image_id: str, _: None = AuthDependency):
+    """Metadatos registrados en el ledger para una imagen (prompt, seed, modelo, petición original)."""
+    ledger = get_ledger()
+    if ledger is None:
+        raise HTTPException(400, "Ledger disabled (set LEDGER_ENABLED=1)")
+    try:
+        record = ledger.get(image_id)
+    except LedgerUnavailable as e:
+        raise HTTPException(503, f"Ledger unavailable: {e}")
+    if record is None:
+        raise HTTPException(404, f"Image '{image_id}' not found")
+    return {**record, "url": url_for(image_id)}
+
+@app.get("/v1/images")
+def list_images(
+    project_id: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    model: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = Query(None, description="epoch seconds (incluido)"),
+    until: Optional[float] = Query(None, description="epoch seconds (excluido)"),
+    limit: int = Query(100, ge=1, le=1000),
+    _: None = AuthDependency,
+):
+    """Consulta del ledger, más recientes primero."""
+    ledger = get_ledger()
+    if ledger is None:
+        raise HTTPException(400, "Ledger disabled (set LEDGER_ENABLED=1)")
+    try:
+        records = ledger.query(project_id=project_id, agent_id=agent_id, model=model, status=status, since=since, until=until, limit=limit)
+    except LedgerUnavailable as e:
+        raise HTTPException(503, f"Ledger unavailable: {e}")
+    return {"count": len(records), "items": records}
 
 @app.get("/v1/jobs/{job_id}")
 def job_status(job_id: str):
     # Deprecated endpoint: previously used for async jobs
     raise HTTPException(410, detail="Endpoint deprecated: generation is synchronous now")
 
+@app.get("/v1/admin/lifecycle")
+def lifecycle_status(_: None = AuthDependency):
+    """Estado de admisión: drenaje, generaciones en vuelo y duración media por modelo."""
+    return _ADMISSION.stats()
+
+@app.post("/v1/admin/drain")
+def drain(payload: Dict[str, bool] | None = Body(default=None), _: None = AuthDependency):
+    """Activa (por defecto) o desactiva el modo drenaje.
+    Body opcional: {"enabled": false} para volver a aceptar generaciones.
+    """
+    enabled = True
+    if payload and isinstance(payload, dict):
+        enabled = bool(payload.get("enabled", True))
+    if enabled:
+        _ADMISSION.start_drain()
+    else:
+        _ADMISSION.stop_drain()
+    return _ADMISSION.stats()
+
+@app.post("/v1/admin/profile", status_code=202)
+def start_profile(payload: Dict[str, float] | None = Body(default=None), _: None = AuthDependency):
+    """Captura un perfil bajo demanda de las generaciones.
+    Body opcional: {"seconds": 10} o {"requests": 3}, {"torch": 0} para omitir
+    torch.profiler, {"interval_ms": 5} para el periodo de muestreo.
+    Resultado en DATA_DIR/profiles/<session_id>/ (python.folded + torch_*.trace.json).
+    """
+    payload = payload or {}
+    seconds = payload.get("seconds")
+    requests = payload.get("requests")
+    if seconds is None and requests is None:
+        seconds = 10
+    if (seconds is not None and seconds <= 0) or (requests is not None and requests < 1):
+        raise HTTPException(400, "seconds must be > 0 and requests >= 1")
+    try:
+        session = _PROFILER.start(
+            seconds=seconds,
+            requests=int(requests) if requests is not None else None,
+            use_torch=bool(payload.get("torch", 1)),
+            interval=max(1.0, payload.get("interval_ms", 5)) / 1000,
+        )
+    except ProfileBusy as e:
+        raise HTTPException(409, f"Profile session '{e}' already running")
+    return session.summary()
+
+@app.get("/v1/admin/profile")
+def profile_status(_: None = AuthDependency):
+    """Estado de la sesión de perfilado actual (o de la última)."""
+    status = _PROFILER.status()
+    if status is None:
+        raise HTTPException(404, "No profile sessions yet")
+    return status
+
 @app.get("/metrics")
 def metrics():
     if not metrics_enabled():
@@ -156,7 +456,8 @@ def purge_models(payload: Dict[str, str] | None = Body(default=None), _: None =
     if payload and isinstance(payload, dict):
         model_id = payload.get("model_id")
     try:
-        result = _MULTI_ENGINE.purge(model_id=model_id)
+        # Esperar a las generaciones en vuelo como mucho el timeout de generación
+        result = _MULTI_ENGINE.purge(model_id=model_id, timeout=generation_timeout_seconds() or None)
         # Incluir siempre la clave model_id (puede ser None)
         result = {"model_id": model_id, **result}
         return result
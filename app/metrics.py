@@ -10,10 +10,11 @@ def metrics_enabled() -> bool:
 _registry: Optional[CollectorRegistry] = None
 _generation_counter: Optional[Counter] = None
 _generation_hist: Optional[Histogram] = None
+_rejection_counter: Optional[Counter] = None
 
 
 def _ensure_metrics():
-    global _registry, _generation_counter, _generation_hist
+    global _registry, _generation_counter, _generation_hist, _rejection_counter
     if _registry is None:
         _registry = CollectorRegistry()
         _generation_counter = Counter(
@@ -29,6 +30,12 @@ def _ensure_metrics():
             registry=_registry,
             buckets=(0.1,0.25,0.5,1,2,4,8,16,32,64)
         )
+        _rejection_counter = Counter(
+            "image_generation_rejections_total",
+            "Solicitudes rechazadas antes de generar (drenaje / sobrecarga)",
+            ["reason", "model"],
+            registry=_registry,
+        )
 
 
 def record_generation(status: str, model: str, duration_sec: float):
@@ -41,6 +48,14 @@ def record_generation(status: str, model: str, duration_sec: float):
     _generation_hist.labels(model=model).observe(duration_sec)
 
 
+def record_rejection(reason: str, model: str):
+    if not metrics_enabled():
+        return
+    _ensure_metrics()
+    assert _rejection_counter
+    _rejection_counter.labels(reason=reason, model=model).inc()
+
+
 def prometheus_exposition_body() -> bytes:
     if not metrics_enabled():
         return b""  # vacío
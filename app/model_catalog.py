@@ -0,0 +1,37 @@
+from typing import Dict, List
+from app.models import ImageModelInfo
+
+# Samplers expuestos -> (clase de scheduler en diffusers, overrides de config).
+# Se resuelven en el motor con getattr(diffusers, clase) para no importar diffusers aquí.
+SAMPLERS: Dict[str, tuple] = {
+    "euler": ("EulerDiscreteScheduler", {}),
+    "euler_a": ("EulerAncestralDiscreteScheduler", {}),
+    "dpmpp_2m": ("DPMSolverMultistepScheduler", {}),
+    "dpmpp_2m_karras": ("DPMSolverMultistepScheduler", {"use_karras_sigmas": True}),
+    "ddim": ("DDIMScheduler", {}),
+    "unipc": ("UniPCMultistepScheduler", {}),
+    "lcm": ("LCMScheduler", {}),
+}
+
+# Perfiles conocidos; el resto usa _GENERIC o el perfil destilado según el nombre
+_GENERIC = {"family": "sdxl", "min_vram_gb": 8.0, "resolution": "best@1024", "recommended_steps": 25, "recommended_cfg": 7.5}
+# Modelos destilados (turbo/lightning/LCM): pocos pasos y sin CFG
+_DISTILLED = {**_GENERIC, "recommended_steps": 4, "recommended_cfg": 0.0}
+_KNOWN: Dict[str, dict] = {
+    "stabilityai/sdxl-turbo": {**_DISTILLED, "resolution": "best@512", "recommended_steps": 2},
+    "stabilityai/stable-diffusion-xl-base-1.0": {**_GENERIC, "recommended_steps": 30, "recommended_cfg": 7.0},
+}
+_DISTILLED_MARKERS = ("turbo", "lightning", "lcm")
+
+
+def model_info(model_id: str) -> ImageModelInfo:
+    """Ficha del modelo con pasos/CFG recomendados."""
+    profile = _KNOWN.get(model_id)
+    if profile is None:
+        distilled = any(marker in model_id.lower() for marker in _DISTILLED_MARKERS)
+        profile = _DISTILLED if distilled else _GENERIC
+    return ImageModelInfo(name=model_id, tag=["multi-model"], samplers=sampler_names(), **profile)
+
+
+def sampler_names() -> List[str]:
+    return list(SAMPLERS)
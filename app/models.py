@@ -7,11 +7,28 @@ class HealthStatus(BaseModel):
 class GenerateParams(BaseModel):
     width: int = Field(1024, ge=64, le=2048)
     height: int = Field(1024, ge=64, le=2048)
-    steps: int = Field(25, ge=1, le=100)
-    cfg: float = Field(7.5, ge=0, le=20)
+    # None -> valores recomendados del modelo (ver /v1/models)
+    steps: Optional[int] = Field(None, ge=1, le=100)
+    cfg: Optional[float] = Field(None, ge=0, le=20)
     seed: Optional[int] = None
     model: Optional[str] = None
+    # None -> scheduler por defecto del checkpoint
+    sampler: Optional[str] = None
     
+class RefineParams(BaseModel):
+    steps: int = Field(10, ge=1, le=100)
+    # None -> reutilizar cfg/seed/sampler de la generación original
+    cfg: Optional[float] = Field(None, ge=0, le=20)
+    seed: Optional[int] = None
+    sampler: Optional[str] = None
+    strength: float = Field(0.5, gt=0, le=1)
+    scale: float = Field(1.0, ge=1, le=2)
+
+class RefineRequest(BaseModel):
+    image_id: str
+    params: RefineParams = RefineParams()
+    deadline_ms: Optional[int] = Field(None, ge=1)
+
 class SafetyConfig(BaseModel):
     allow_mature_implicit: bool = Field(False, alias="allow_mature_implicit")
 
@@ -26,6 +43,8 @@ class GenerateRequest(BaseModel):
     safety: SafetyConfig = SafetyConfig()
     # Correct typo: metada -> metadata (keep alias for backward compatibility)
     metadata: Metadata = Field(default_factory=Metadata, alias="metada")
+    # Plazo del cliente: se rechaza (503) si la espera estimada no permite cumplirlo
+    deadline_ms: Optional[int] = Field(None, ge=1)
     # Usar ConfigDict (Pydantic v2) para evitar deprecation warning
     model_config = ConfigDict(populate_by_name=True)
     
@@ -49,5 +68,8 @@ class ImageModelInfo(BaseModel):
     family: str
     min_vram_gb: float | None = None
     resolution: str | None = None
+    recommended_steps: int | None = None
+    recommended_cfg: float | None = None
+    samplers: List[str] = Field(default_factory=list)
     tag: List[str] = Field(default_factory=list)
     
\ No newline at end of file
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+from app.config import PROFILES_DIR
+
+# Environment variables:
+# PROFILE_SLOW_THRESHOLD_SECONDS (default 0 -> desactivado): una generación más lenta
+#   arma automáticamente un perfil de las siguientes PROFILE_SLOW_CAPTURE_REQUESTS peticiones
+# PROFILE_SLOW_COOLDOWN_SECONDS (default 300): mínimo entre perfiles automáticos
+
+def slow_threshold_seconds() -> float:
+    try:
+        return float(os.getenv("PROFILE_SLOW_THRESHOLD_SECONDS", "0"))
+    except ValueError:
+        return 0.0
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+MAX_SESSION_SECONDS = 300
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+class ProfileSession:
+    """Una captura: muestreo de pilas Python de los hilos de generación y, si torch
+    ya está cargado, trazas de operadores CPU de torch.profiler por petición.
+    """
+    def __init__(self, seconds: Optional[float], requests: Optional[int], use_torch: bool, interval: float, reason: str):
+        self.id = f"prof_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.dir = os.path.join(PROFILES_DIR, self.id)
+        self.reason = reason
+        self.use_torch = use_torch
+        self.interval = interval
+        self.started = time.time()
+        self.deadline = time.monotonic() + min(seconds or MAX_SESSION_SECONDS, MAX_SESSION_SECONDS)
+        self.remaining = requests  # None -> modo por tiempo
+        self.requests_profiled = 0
+        self.in_flight = 0
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.files: Dict[str, str] = {}
+        self.finished = threading.Event()
+
+    def summary(self) -> Dict:
+        return {
+            "session_id": self.id,
+            "status": "finished" if self.finished.is_set() else "running",
+            "reason": self.reason,
+            "started": self.started,
+            "dir": self.dir,
+            "requests_profiled": self.requests_profiled,
+            "remaining_requests": self.remaining,
+            "samples": self.sample_count,
+            "files": self.files,
+        }
+
+
+class _Tracker:
+    """Seguimiento de una petición. Inactivo (sin sesión ni umbral) no hace nada."""
+    __slots__ = ("_profiler", "label", "model", "session", "start")
+
+    def __init__(self, profiler: "Profiler", label: str, model: str, session: Optional[ProfileSession]):
+        self._profiler = profiler
+        self.label = label
+        self.model = model
+        self.session = session
+        self.start = time.monotonic()
+
+    def wrap(self, fn: Callable) -> Callable:
+        """Envuelve la llamada al motor: registra el hilo que la ejecuta para el
+        muestreo y, si procede, la ejecuta bajo torch.profiler.
+        """
+        session = self.session
+        if session is None:
+            return fn
+        profiler = self._profiler
+
+        def _profiled():
+            tid = threading.get_ident()
+            profiler._register(tid, self.label)
+            try:
+                if session.use_torch and "torch" in sys.modules:
+                    return profiler._run_with_torch(session, fn)
+                return fn()
+            finally:
+                profiler._unregister(tid)
+        return _profiled
+
+    def end(self) -> float:
+        duration = time.monotonic() - self.start
+        self._profiler._end_request(self, duration)
+        return duration
+
+
+class Profiler:
+    """Perfiles bajo demanda del camino caliente (generate / pipeline diffusers).
+
+    Sin sesión activa el coste por petición es una lectura de atributo y, si hay
+    umbral de lentitud, una llamada a time.monotonic().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session: Optional[ProfileSession] = None
+        self._last: Optional[ProfileSession] = None
+        self._threads: Dict[int, str] = {}
+        self._last_auto = 0.0
+        self._torch_seq = 0
+
+    # --- API de control ---
+    def start(self, seconds: Optional[float] = None, requests: Optional[int] = None, use_torch: bool = True,
+              interval: float = 0.005, reason: str = "manual") -> ProfileSession:
+        with self._lock:
+            if self._session is not None:
+                raise ProfileBusy(self._session.id)
+            session = ProfileSession(seconds, requests, use_torch, interval, reason)
+            os.makedirs(session.dir, exist_ok=True)
+            self._session = session
+        threading.Thread(target=self._sample_loop, args=(session,), name=f"profiler-{session.id}", daemon=True).start()
+        logging.getLogger("uvicorn.error").info("profile.started", extra=session.summary())
+        return session
+
+    def status(self) -> Optional[Dict]:
+        session = self._session or self._last
+        return session.summary() if session else None
+
+    # --- Hooks del camino caliente ---
+    def begin(self, label: str, model: str) -> _Tracker:
+        session = self._session
+        if session is not None:
+            with self._lock:
+                if session.remaining is not None:
+                    if session.remaining <= 0:
+                        session = None
+                    else:
+                        session.remaining -= 1
+                if session is not None:
+                    session.in_flight += 1
+                    session.requests_profiled += 1
+        return _Tracker(self, label, model, session)
+
+    def _end_request(self, tracker: _Tracker, duration: float) -> None:
+        session = tracker.session
+        if session is not None:
+            with self._lock:
+                session.in_flight -= 1
+                done = session.remaining == 0 and session.in_flight == 0
+            if done:
+                self._finish(session)
+        threshold = slow_threshold_seconds()
+        if threshold > 0 and duration > threshold:
+            self._on_slow(tracker, duration)
+
+    def _on_slow(self, tracker: _Tracker, duration: float) -> None:
+        logger = logging.getLogger("uvicorn.error")
+        logger.warning("profile.slow_request", extra={"label": tracker.label, "model": tracker.model, "duration_sec": round(duration, 3)})
+        now = time.monotonic()
+        with self._lock:
+            cooldown = _env_int("PROFILE_SLOW_COOLDOWN_SECONDS", 300)
+            if self._session is not None or (self._last_auto and now - self._last_auto < cooldown):
+                return
+            self._last_auto = now
+        try:
+            self.start(requests=max(1, _env_int("PROFILE_SLOW_CAPTURE_REQUESTS", 1)),
+                       reason=f"slow:{tracker.model}:{duration:.2f}s")
+        except ProfileBusy:
+            pass
+
+    # --- Internos ---
+    def _register(self, tid: int, label: str) -> None:
+        with self._lock:
+            self._threads[tid] = label
+
+    def _unregister(self, tid: int) -> None:
+        with self._lock:
+            self._threads.pop(tid, None)
+
+    def _run_with_torch(self, session: ProfileSession, fn: Callable):
+        # torch ya está cargado por el motor; no se fuerza la importación
+        from torch.profiler import ProfilerActivity, profile
+        with self._lock:
+            self._torch_seq += 1
+            seq = self._torch_seq
+        with profile(activities=[ProfilerActivity.CPU]) as prof:
+            result = fn()
+        path = os.path.join(session.dir, f"torch_{seq:03d}.trace.json")
+        prof.export_chrome_trace(path)
+        with self._lock:
+            session.files[f"torch_{seq:03d}"] = path
+        return result
+
+    def _sample_loop(self, session: ProfileSession) -> None:
+        own = threading.get_ident()
+        while not session.finished.is_set():
+            if time.monotonic() >= session.deadline:
+                self._finish(session)
+                break
+            with self._lock:
+                threads = dict(self._threads)
+            if threads:
+                frames = sys._current_frames()
+                stacks = [_fold(frames[tid], label) for tid, label in threads.items() if tid in frames and tid != own]
+                del frames
+                with self._lock:
+                    if not session.finished.is_set():
+                        session.samples.update(stacks)
+                        session.sample_count += len(stacks)
+            session.finished.wait(session.interval)
+
+    def _finish(self, session: ProfileSession) -> None:
+        with self._lock:
+            if session.finished.is_set():
+                return
+            session.finished.set()
+            if self._session is session:
+                self._session = None
+            self._last = session
+            samples = session.samples.most_common()
+        # Formato "folded" (flamegraph.pl, speedscope, inferno)
+        folded = os.path.join(session.dir, "python.folded")
+        with open(folded, "w") as f:
+            for stack, count in samples:
+                f.write(f"{stack} {count}\n")
+        session.files["python"] = folded
+        with open(os.path.join(session.dir, "summary.json"), "w") as f:
+            json.dump(session.summary(), f, indent=2)
+        logging.getLogger("uvicorn.error").info("profile.finished", extra=session.summary())
+
+
+def _fold(frame, root: str) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.append(root)
+    return ";".join(reversed(parts))
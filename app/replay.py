@@ -0,0 +1,121 @@
+"""Re-ejecuta peticiones registradas en el ledger contra un servicio (benchmark de regresión).
+
+Uso:
+    python -m app.replay --base-url http://localhost:8001 --limit 50
+    python -m app.replay --project-id demo --since 1700000000 --api-key devtoken --json
+
+Solo se reproducen generaciones completadas (`kind=generate`); se fija el seed
+registrado para que la salida sea comparable con la original. Las repeticiones
+anteriores (`agent_id=replay`) se excluyen salvo con `--include-replays`.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+from app.ledger import Ledger, ledger_path
+
+REPLAY_AGENT_ID = "replay"
+
+
+def replay_payload(record: Dict) -> Dict:
+    """Petición original con los valores efectivos (seed, steps, cfg) fijados.
+
+    No se reenvían `deadline_ms` ni los metadatos originales: la repetición se
+    registra con `agent_id="replay"` y no se atribuye al proyecto/agente original.
+    """
+    payload = dict(record.get("request") or {"prompt": record["prompt"]})
+    for key in ("deadline_ms", "metada"):
+        payload.pop(key, None)
+    payload["metadata"] = {"agent_id": REPLAY_AGENT_ID}
+    params = dict(payload.get("params") or {})
+    params.update({"seed": record["seed"], "steps": record["steps"], "cfg": record["cfg"], "model": record["model"]})
+    if record.get("sampler"):
+        params["sampler"] = record["sampler"]
+    payload["params"] = params
+    return payload
+
+
+def select_records(ledger: Ledger, include_replays: bool = False, **filters) -> List[Dict]:
+    """Generaciones completadas a reproducir, en orden cronológico."""
+    if not include_replays and filters.get("agent_id") != REPLAY_AGENT_ID:
+        filters["exclude_agent_id"] = REPLAY_AGENT_ID
+    records = ledger.query(status="completed", kind="generate", **filters)
+    # Orden cronológico, como llegaron originalmente
+    records.reverse()
+    return records
+
+
+def replay(records: Sequence[Dict], base_url: str, api_key: Optional[str] = None, timeout: float = 300.0) -> List[Dict]:
+    headers = {"X-API-Key": api_key} if api_key else {}
+    results = []
+    with httpx.Client(base_url=base_url, headers=headers, timeout=timeout) as client:
+        for record in records:
+            start = time.perf_counter()
+            try:
+                r = client.post("/v1/generate", json=replay_payload(record))
+                status = r.status_code
+            except httpx.HTTPError as e:
+                status = f"error: {e}"
+            elapsed = time.perf_counter() - start
+            results.append({
+                "image_id": record["image_id"],
+                "model": record["model"],
+                "status": status,
+                "seconds": round(elapsed, 3),
+                "original_seconds": record.get("duration_sec"),
+            })
+    return results
+
+
+def summarize(results: Sequence[Dict]) -> Dict:
+    ok = [r["seconds"] for r in results if r["status"] == 200]
+    orig = [r["original_seconds"] for r in results if r["status"] == 200 and r["original_seconds"] is not None]
+    summary = {"total": len(results), "ok": len(ok), "failed": len(results) - len(ok)}
+    if ok:
+        summary["p50_sec"] = round(statistics.median(ok), 3)
+        summary["p95_sec"] = round(sorted(ok)[max(0, int(len(ok) * 0.95) - 1)], 3)
+        summary["mean_sec"] = round(statistics.fmean(ok), 3)
+    if orig:
+        summary["original_p50_sec"] = round(statistics.median(orig), 3)
+    return summary
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.replay", description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--ledger", default=None, help="ruta del ledger (por defecto DATA_DIR/ledger.sqlite3)")
+    parser.add_argument("--project-id", default=None)
+    parser.add_argument("--agent-id", default=None)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--since", type=float, default=None, help="epoch seconds")
+    parser.add_argument("--until", type=float, default=None, help="epoch seconds")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--include-replays", action="store_true", help="incluir repeticiones anteriores (agent_id=replay)")
+    parser.add_argument("--json", action="store_true", help="salida JSON (resultados + resumen)")
+    args = parser.parse_args(argv)
+
+    ledger = Ledger(args.ledger or ledger_path())
+    try:
+        records = select_records(ledger, include_replays=args.include_replays, project_id=args.project_id, agent_id=args.agent_id,
+                                 model=args.model, since=args.since, until=args.until, limit=args.limit)
+    finally:
+        ledger.close()
+    results = replay(records, args.base_url, api_key=args.api_key)
+    summary = summarize(results)
+    if args.json:
+        print(json.dumps({"results": results, "summary": summary}, indent=2))
+    else:
+        for r in results:
+            print(f"{r['image_id']:<14}{r['model']:<40}{str(r['status']):<8}{r['seconds']:>8.3f}s  (orig {r['original_seconds']}s)")
+        print(json.dumps(summary))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
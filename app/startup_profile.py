@@ -0,0 +1,101 @@
+"""Informe de tiempo de arranque (importaciones) del servicio.
+
+Uso:
+    python -m app.startup_profile            # solo la app HTTP (app.main)
+    python -m app.startup_profile --engine   # incluye torch/diffusers (motor real)
+    python -m app.startup_profile --top 30
+
+Cada medición se hace en un intérprete nuevo con `-X importtime`, así que refleja
+un arranque en frío (p. ej. un worker de uvicorn recién lanzado).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Sequence
+
+# Módulos que nunca deberían cargarse solo por importar la app HTTP
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "accelerate", "numpy")
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - t
+print(json.dumps({{"seconds": elapsed, "heavy": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def _run_probe(modules: Sequence[str], importtime: bool) -> subprocess.CompletedProcess:
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", _PROBE.format(modules=list(modules), heavy=HEAVY_MODULES)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run(cmd, capture_output=True, text=True, cwd=root, check=True)
+
+
+def measure_cold_start(modules: Sequence[str] = ("app.main",)) -> Dict:
+    """Tiempo de importación en frío de `modules` y módulos pesados que arrastran."""
+    return json.loads(_run_probe(modules, importtime=False).stdout.strip().splitlines()[-1])
+
+
+def parse_importtime(stderr: str) -> List[ImportRecord]:
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, module = line[len("import time:"):].split("|", 2)
+            records.append(ImportRecord(module.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return records
+
+
+def summarize_by_package(records: Sequence[ImportRecord]) -> Dict[str, int]:
+    """Tiempo propio (us) agregado por paquete raíz, de mayor a menor."""
+    totals: Dict[str, int] = defaultdict(int)
+    for r in records:
+        totals[r.module.split(".")[0]] += r.self_us
+    return dict(sorted(totals.items(), key=lambda kv: kv[1], reverse=True))
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.startup_profile", description=__doc__.splitlines()[0])
+    parser.add_argument("--engine", action="store_true", help="incluir app.engines.diffuser_engine (torch/diffusers)")
+    parser.add_argument("--top", type=int, default=15, help="número de filas por tabla")
+    args = parser.parse_args(argv)
+
+    modules = ["app.main"] + (["app.engines.diffuser_engine"] if args.engine else [])
+    try:
+        proc = _run_probe(modules, importtime=True)
+    except subprocess.CalledProcessError as e:
+        tail = e.stderr.strip().splitlines()[-1:] if e.stderr else []
+        print(f"Fallo importando {', '.join(modules)}: {' '.join(tail)}", file=sys.stderr)
+        return 1
+    probe = json.loads(proc.stdout.strip().splitlines()[-1])
+    records = parse_importtime(proc.stderr)
+
+    print(f"Importar {', '.join(modules)}: {probe['seconds'] * 1000:.0f} ms (con -X importtime)")
+    print(f"Módulos pesados cargados: {', '.join(probe['heavy']) or 'ninguno'}")
+    print(f"\n{'paquete':<32}{'propio ms':>12}")
+    for pkg, us in list(summarize_by_package(records).items())[:args.top]:
+        print(f"{pkg:<32}{us / 1000:>12.1f}")
+    print(f"\n{'módulo':<48}{'acumulado ms':>14}")
+    for r in sorted(records, key=lambda r: r.cumulative_us, reverse=True)[:args.top]:
+        print(f"{r.module:<48}{r.cumulative_us / 1000:>14.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,81 @@
+import hashlib
+import io
 import os
 import uuid
 from PIL import Image
-from app.config import IMAGES_DIR, BASE_URL
+from app.config import IMAGES_DIR, THUMBS_DIR, BASE_URL
 
+# Directorios creados en la primera escritura (no al importar)
+_ready_dirs: set = set()
 
-os.makedirs(IMAGES_DIR, exist_ok=True)
+def _ensure_dir(directory: str) -> None:
+    if directory not in _ready_dirs:
+        os.makedirs(directory, exist_ok=True)
+        _ready_dirs.add(directory)
 
 def new_image_id() -> str:
     return f"im_{uuid.uuid4().hex[:8]}"
 
 def save_placeholder(image_id: str, width: int = 512, height: int = 512) -> str:
-    path = path_for(image_id)
     img = Image.new("RGB", (width, height), color=(240, 240, 240))
-    img.save(path, format="PNG")
+    return save_image(image_id, img)
+
+def save_image(image_id: str, image: Image.Image) -> str:
+    """Guarda la imagen como PNG junto a su ETag fuerte (sha256 del contenido)."""
+    return _write_png(path_for(image_id), image)
+
+def _write_png(path: str, image: Image.Image) -> str:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    data = buf.getvalue()
+    _ensure_dir(os.path.dirname(path))
+    # Escritura atómica: el ETag nunca describe un fichero a medio escribir
+    tmp = f"{path}.{uuid.uuid4().hex[:6]}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    _write_etag(path, hashlib.sha256(data).hexdigest()[:32])
+    os.replace(tmp, path)
     return path
 
+def _write_etag(path: str, digest: str) -> None:
+    # Igual que el PNG: un lector concurrente nunca ve el sidecar vacío o a medias
+    tmp = f"{path}.etag.{uuid.uuid4().hex[:6]}.tmp"
+    with open(tmp, "w") as f:
+        f.write(f'"{digest}"')
+    os.replace(tmp, f"{path}.etag")
+
+def etag_for(path: str) -> str:
+    """ETag almacenado al escribir la imagen. Para ficheros antiguos sin sidecar se
+    calcula una vez y se persiste.
+    """
+    try:
+        with open(f"{path}.etag") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+        _write_etag(path, h.hexdigest()[:32])
+        return f'"{h.hexdigest()[:32]}"'
+
 def path_for(image_id: str) -> str:
     return os.path.join(IMAGES_DIR, f"{image_id}.png")
 
+def thumbnail_path_for(image_id: str, width: int) -> str:
+    """Devuelve la miniatura cacheada en disco, renderizándola la primera vez."""
+    path = os.path.join(THUMBS_DIR, f"{image_id}_w{width}.png")
+    if not os.path.exists(path):
+        with Image.open(path_for(image_id)) as img:
+            if width >= img.width:
+                return path_for(image_id)  # nunca ampliar
+            height = max(1, round(img.height * width / img.width))
+            thumb = img.resize((width, height), Image.LANCZOS)
+        _write_png(path, thumb)
+    return path
+
 def url_for(image_id: str) -> str:
     rel = f"/files/{image_id}.png"
     if BASE_URL:
         return f"{BASE_URL.rstrip('/')}{rel}"
-    return rel
\ No newline at end of file
+    return rel
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from app.main import app
+import app.main as main_module
+import app.ledger as ledger_module
+from app.lifecycle import AdmissionController
+
+
+class StubEngine:
+    """Motor de prueba: imágenes de color sólido, registra cada llamada.
+
+    Parametrizable con `@pytest.mark.parametrize("engine", [{"color": ...}], indirect=True)`.
+    """
+    def __init__(self, color=(0, 0, 0)):
+        self.color = color
+        self.calls = []
+
+    def generate_image(self, prompt, negative, width, height, steps, cfg, seed, return_latents=False, sampler=None):
+        self.calls.append({"steps": steps, "cfg": cfg, "sampler": sampler})
+        image = Image.new("RGB", (width, height), color=self.color)
+        if not return_latents:
+            return image
+        state = {
+            "latents": np.zeros((1, 4, height // 8, width // 8), dtype=np.float16),
+            "prompt_embeds": np.zeros((1, 2, 4), dtype=np.float16),
+        }
+        return image, state
+
+    def refine_image(self, state, steps, cfg, seed, strength=0.5, scale=1.0, sampler=None):
+        h, w = state["latents"].shape[-2:]
+        size = (round(w * scale) * 8, round(h * scale) * 8)
+        return Image.new("RGB", size, color=self.color), state
+
+
+@pytest.fixture(autouse=True)
+def isolated_ledger(tmp_path, monkeypatch):
+    """Cada test con su propio ledger: nunca se escribe en DATA_DIR/ledger.sqlite3."""
+    monkeypatch.setenv("LEDGER_PATH", str(tmp_path / "ledger.sqlite3"))
+    monkeypatch.setattr(ledger_module, "_ledger", None)
+    yield
+    if ledger_module._ledger is not None:
+        ledger_module._ledger.close()
+
+
+@pytest.fixture()
+def engine(request):
+    return StubEngine(**getattr(request, "param", {}))
+
+
+@pytest.fixture()
+def admission():
+    return AdmissionController()
+
+
+@pytest.fixture()
+def client(engine, admission, monkeypatch):
+    """Cliente contra la app con `engine` como motor, sin API key ni timeout."""
+    monkeypatch.setenv("REQUIRE_API_KEY", "0")
+    monkeypatch.setattr(main_module, "generation_timeout_seconds", lambda: 0)
+    monkeypatch.setattr(main_module, "get_engine", lambda model_id=None: engine)
+    monkeypatch.setattr(main_module, "_ADMISSION", admission)
+    return TestClient(app)
@@ -0,0 +1,90 @@
+import io
+import os
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from app.main import app
+import app.files as files_module
+import app.storage as storage_module
+from app.files import _etag_matches
+from app.storage import new_image_id, save_image, path_for
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def data_dirs(tmp_path, monkeypatch):
+    # Imágenes, miniaturas y sidecars en un directorio temporal (path_for lee IMAGES_DIR)
+    monkeypatch.setattr(storage_module, "IMAGES_DIR", str(tmp_path / "images"))
+    monkeypatch.setattr(storage_module, "THUMBS_DIR", str(tmp_path / "thumbs"))
+    monkeypatch.setattr(files_module, "IMAGES_DIR", str(tmp_path / "images"))
+    return tmp_path
+
+
+def _saved_image(width=256, height=128):
+    image_id = new_image_id()
+    save_image(image_id, Image.new("RGB", (width, height), color=(10, 200, 30)))
+    return image_id
+
+
+def test_immutable_headers_and_stored_etag():
+    image_id = _saved_image()
+    r = client.get(f"/files/{image_id}.png")
+    assert r.status_code == 200
+    assert "immutable" in r.headers["cache-control"]
+    with open(path_for(image_id) + ".etag") as f:
+        assert r.headers["etag"] == f.read()
+    with open(path_for(image_id), "rb") as f:
+        assert r.content == f.read()
+
+
+def test_conditional_request_not_modified():
+    image_id = _saved_image()
+    etag = client.get(f"/files/{image_id}.png").headers["etag"]
+    r = client.get(f"/files/{image_id}.png", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+
+
+def test_empty_etag_never_matches(data_dirs):
+    assert not _etag_matches("", "")
+    assert not _etag_matches("", '"abc"')
+    image_id = _saved_image()
+    r = client.get(f"/files/{image_id}.png", headers={"If-None-Match": ""})
+    assert r.status_code == 200 and r.content
+    # El sidecar se escribe de forma atómica: no quedan temporales
+    assert not [p for p in os.listdir(data_dirs / "images") if p.endswith(".tmp")]
+
+
+def test_range_requests():
+    image_id = _saved_image()
+    with open(path_for(image_id), "rb") as f:
+        data = f.read()
+    r = client.get(f"/files/{image_id}.png", headers={"Range": "bytes=0-9"})
+    assert r.status_code == 206
+    assert r.content == data[:10]
+    assert r.headers["content-range"] == f"bytes 0-9/{len(data)}"
+    r = client.get(f"/files/{image_id}.png", headers={"Range": "bytes=-5"})
+    assert r.status_code == 206 and r.content == data[-5:]
+    r = client.get(f"/files/{image_id}.png", headers={"Range": f"bytes={len(data)}-"})
+    assert r.status_code == 416
+
+
+def test_thumbnail_variant_cached_on_disk(data_dirs):
+    image_id = _saved_image()
+    r = client.get(f"/files/{image_id}.png?w=128")
+    assert r.status_code == 200
+    with Image.open(io.BytesIO(r.content)) as thumb:
+        assert thumb.size == (128, 64)
+    assert (data_dirs / "thumbs" / f"{image_id}_w128.png").exists()
+    assert r.headers["etag"] != client.get(f"/files/{image_id}.png").headers["etag"]
+
+
+def test_thumbnail_width_not_allowed():
+    image_id = _saved_image()
+    assert client.get(f"/files/{image_id}.png?w=77").status_code == 400
+
+
+def test_missing_and_invalid_names():
+    assert client.get("/files/im_nothere.png").status_code == 404
+    assert client.get("/files/..%2Fsecret.png").status_code == 404
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import app.latent_cache as latent_cache_module
+from app.latent_cache import LatentCache
+
+
+def _state(v=0.5):
+    return {"latents": np.full((1, 4, 8, 8), v, dtype=np.float16), "prompt_embeds": np.zeros((1, 2, 4), dtype=np.float16)}
+
+
+def test_ram_lru_evicts_oldest():
+    cache = LatentCache(max_entries=2)
+    cache.put("a", _state(), {"seed": 1})
+    cache.put("b", _state(), {"seed": 2})
+    cache.get("a")  # "a" pasa a ser el más reciente
+    cache.put("c", _state(), {"seed": 3})
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_spill_to_disk_roundtrip(tmp_path):
+    cache = LatentCache(max_entries=1, disk_dir=str(tmp_path), max_disk_entries=2)
+    cache.put("a", _state(0.25), {"seed": 7, "model": "m"})
+    cache.put("b", _state(), {"seed": 8})
+    assert (tmp_path / "a.npz").exists()
+    state, meta = cache.get("a")
+    assert meta == {"seed": 7, "model": "m"}
+    assert state["latents"].dtype == np.float16
+    assert float(state["latents"][0, 0, 0, 0]) == 0.25
+    # Un proceso nuevo reindexa los spills existentes
+    assert "a" in LatentCache(max_entries=1, disk_dir=str(tmp_path), max_disk_entries=2)
+
+
+@pytest.fixture()
+def client(client, monkeypatch):
+    monkeypatch.setattr(latent_cache_module, "LATENT_CACHE_SIZE", 4)
+    monkeypatch.setattr(latent_cache_module, "LATENT_CACHE_DISK_SIZE", 0)
+    monkeypatch.setattr(latent_cache_module, "_cache", None)
+    return client
+
+
+def test_refine_from_cached_latents(client):
+    r = client.post("/v1/generate", json={"prompt": "preview", "params": {"width": 64, "height": 64, "steps": 1, "cfg": 1, "seed": 5}})
+    assert r.status_code == 200, r.text
+    image_id = r.json()["images"][0]["image_id"]
+    r2 = client.post("/v1/refine", json={"image_id": image_id, "params": {"steps": 4, "strength": 0.5, "scale": 1.5}})
+    assert r2.status_code == 200, r2.text
+    body = r2.json()
+    assert body["audit"]["parent"] == image_id
+    assert body["images"][0]["seed"] == 5
+    assert body["images"][0]["image_id"] != image_id
+
+
+def test_refine_unknown_image(client):
+    r = client.post("/v1/refine", json={"image_id": "im_missing"})
+    assert r.status_code == 404
@@ -0,0 +1,75 @@
+import time
+import pytest
+import app.ledger as ledger_module
+from app.ledger import Ledger
+from app.replay import replay_payload, select_records
+
+
+def test_ledger_batches_and_queries(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.sqlite3"), batch_size=2, flush_interval=0.05)
+    t0 = time.time()
+    ledger.record({"image_id": "im_a", "kind": "generate", "status": "completed", "project_id": "p1", "created_at": t0})
+    ledger.record({"image_id": "im_b", "kind": "generate", "status": "completed", "project_id": "p2", "created_at": t0 + 1})
+    ledger.record({"image_id": None, "kind": "generate", "status": "failed", "project_id": "p1", "created_at": t0 + 2})
+    assert ledger.flush()
+    assert ledger.get("im_a")["project_id"] == "p1"
+    assert [r["status"] for r in ledger.query(project_id="p1")] == ["failed", "completed"]
+    assert [r["image_id"] for r in ledger.query(since=t0 + 0.5, status="completed")] == ["im_b"]
+    ledger.close()
+
+
+def test_replay_skips_earlier_replays(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.sqlite3"))
+    t0 = time.time()
+    for i, agent in enumerate(["agent-1", None, "replay", "replay"]):
+        ledger.record({"image_id": f"im_{i}", "kind": "generate", "status": "completed", "agent_id": agent, "created_at": t0 + i})
+    assert ledger.flush()
+    assert [r["image_id"] for r in select_records(ledger)] == ["im_0", "im_1"]
+    assert [r["image_id"] for r in select_records(ledger, limit=1)] == ["im_1"]
+    assert len(select_records(ledger, include_replays=True)) == 4
+    assert len(select_records(ledger, agent_id="replay")) == 2
+    ledger.close()
+
+
+@pytest.fixture()
+def ledger(tmp_path, monkeypatch):
+    ledger = Ledger(str(tmp_path / "ledger.sqlite3"))
+    monkeypatch.setattr(ledger_module, "_ledger", ledger)
+    yield ledger
+    ledger.close()
+
+
+def test_image_metadata_endpoint(client, ledger):
+    payload = {"prompt": "a lighthouse", "params": {"width": 64, "height": 64, "steps": 2, "cfg": 1, "seed": 42},
+               "metadata": {"project_id": "proj", "agent_id": "agent-7"}}
+    r = client.post("/v1/generate", json=payload)
+    assert r.status_code == 200, r.text
+    image_id = r.json()["images"][0]["image_id"]
+
+    meta = client.get(f"/v1/images/{image_id}")
+    assert meta.status_code == 200, meta.text
+    body = meta.json()
+    assert body["prompt"] == "a lighthouse"
+    assert body["seed"] == 42
+    assert body["agent_id"] == "agent-7"
+    assert body["request"]["params"]["width"] == 64
+
+    listing = client.get("/v1/images", params={"project_id": "proj"}).json()
+    assert image_id in [i["image_id"] for i in listing["items"]]
+    assert client.get("/v1/images/im_unknown").status_code == 404
+
+    # La petición reproducida fija los valores efectivos registrados
+    replayed = replay_payload(body)
+    assert replayed["params"]["seed"] == 42 and replayed["prompt"] == "a lighthouse"
+    assert replayed["metadata"] == {"agent_id": "replay"}
+    assert "deadline_ms" not in replayed
+
+
+def test_unwritable_ledger_does_not_fail_generation(client, monkeypatch):
+    monkeypatch.setenv("LEDGER_PATH", "/proc/nope/ledger.sqlite3")
+    monkeypatch.setattr(ledger_module, "_ledger", None)
+    payload = {"prompt": "x", "params": {"width": 64, "height": 64, "steps": 1, "cfg": 1}}
+    for _ in range(2):
+        assert client.post("/v1/generate", json=payload).status_code == 200
+    assert client.get("/v1/images").status_code == 503
+    assert ledger_module._ledger.error is not None
@@ -0,0 +1,114 @@
+import threading
+import time
+import pytest
+from app.config import DEFAULT_MODEL
+import app.engines.multi_model_engine as registry_module
+import app.lifecycle as lifecycle_module
+from app.engines.multi_model_engine import MultiModelEngine
+from app.lifecycle import AdmissionController, Rejected
+
+
+@pytest.fixture()
+def admission():
+    return AdmissionController(drain_retry_after=7)
+
+
+def _payload(**extra):
+    return {"prompt": "x", "params": {"width": 64, "height": 64, "steps": 1, "cfg": 1}, **extra}
+
+
+def test_drain_rejects_new_generations(client):
+    r = client.post("/v1/admin/drain")
+    assert r.status_code == 200 and r.json()["draining"] is True
+    assert client.get("/ready").status_code == 503
+    assert client.get("/health").status_code == 200
+    r = client.post("/v1/generate", json=_payload())
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "7"
+    client.post("/v1/admin/drain", json={"enabled": False})
+    assert client.get("/ready").status_code == 200
+    assert client.post("/v1/generate", json=_payload()).status_code == 200
+
+
+def _warm(ctl, model, seconds):
+    # La primera muestra (carga del pipeline) se descarta
+    ctl._observe(model, 30.0)
+    ctl._observe(model, seconds)
+
+
+def test_deadline_shedding_uses_estimated_wait(client, admission):
+    _warm(admission, DEFAULT_MODEL, 2.0)
+    # Sin cola (réplica libre) nunca se descarta
+    assert client.post("/v1/generate", json=_payload(deadline_ms=500)).status_code == 200
+    busy = admission.admit(DEFAULT_MODEL)
+    r = client.post("/v1/generate", json=_payload(deadline_ms=500))
+    assert r.status_code == 503
+    assert "deadline" in r.json()["detail"]
+    assert int(r.headers["retry-after"]) >= 1
+    assert client.post("/v1/generate", json=_payload(deadline_ms=5000)).status_code == 200
+    busy.release()
+
+
+def test_estimate_grows_with_queue_and_timeout_rejects():
+    ctl = AdmissionController()
+    _warm(ctl, "m", 1.0)
+    first = ctl.admit("m", timeout_sec=1.5)
+    assert ctl.estimated_completion("m") == pytest.approx(2.0)
+    with pytest.raises(Rejected) as exc:
+        ctl.admit("m", timeout_sec=1.5)
+    assert exc.value.reason == "overload"
+    first.release()
+    assert ctl.wait_idle(timeout=0.1)
+
+
+def test_admission_recovers_after_slow_first_request():
+    ctl = AdmissionController(stale_after=0.05)
+    # Primera generación lenta (carga de pesos): no entra en la media
+    ctl._observe("m", 30.0)
+    assert ctl.estimated_completion("m") is None
+    ctl.admit("m", deadline_ms=5000).release()
+    # Un pico posterior se limita y, sin muestras nuevas, la media caduca
+    ctl._observe("m", 1.0)
+    ctl._observe("m", 30.0)
+    assert ctl.estimated_completion("m") < 3.0
+    busy = ctl.admit("m")
+    with pytest.raises(Rejected):
+        ctl.admit("m", deadline_ms=1000)
+    time.sleep(0.06)
+    ctl.admit("m", deadline_ms=1000).release()
+    busy.release()
+
+
+class SleepingEngine:
+    def __init__(self, model_id):
+        self.model_id = model_id
+
+    def generate_image(self, *args, **kwargs):
+        time.sleep(0.05)
+
+
+def test_estimate_uses_service_time_not_queue_wait(monkeypatch):
+    monkeypatch.setattr(registry_module, "replicas_for", lambda m: 1)
+    monkeypatch.setattr(lifecycle_module, "replicas_for", lambda m: 1)
+    ctl = AdmissionController()
+    registry = MultiModelEngine(engine_factory=SleepingEngine)
+
+    def run(ticket):
+        handle = registry.get(DEFAULT_MODEL)
+        handle.generate_image()
+        ticket.completed(handle.service_seconds)
+        ticket.release()
+
+    # Cola de 5 detrás de una réplica: las últimas esperan ~0.25 s antes de ejecutar
+    tickets = [ctl.admit(DEFAULT_MODEL) for _ in range(6)]
+    threads = [threading.Thread(target=run, args=(t,)) for t in tickets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    busy = [ctl.admit(DEFAULT_MODEL) for _ in range(2)]
+    estimate = ctl.estimated_completion(DEFAULT_MODEL)
+    # (waves + 1) x tiempo de servicio, sin contar dos veces la cola
+    assert 3 * 0.05 <= estimate < 3 * 0.08
+    for ticket in busy:
+        ticket.release()
@@ -0,0 +1,99 @@
+import threading
+import time
+from PIL import Image
+import app.engines.multi_model_engine as registry_module
+from app.engines.multi_model_engine import MultiModelEngine
+from app.config import DEFAULT_MODEL
+
+
+class CountingEngine:
+    """Motor simulado que registra cuántas ejecuciones concurrentes sufre."""
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_image(self, prompt, negative, width, height, steps, cfg, seed):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+        return Image.new("RGB", (width, height), color=(0, 0, 0))
+
+
+def _run_parallel(handle, n):
+    threads = [
+        threading.Thread(target=handle.generate_image, args=("p", None, 8, 8, 1, 1.0, 1))
+        for _ in range(n)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_single_replica_serializes_pipeline():
+    created = []
+
+    def factory(mid):
+        eng = CountingEngine(mid)
+        created.append(eng)
+        return eng
+
+    registry = MultiModelEngine(engine_factory=factory)
+    _run_parallel(registry.get(DEFAULT_MODEL), 4)
+    assert len(created) == 1
+    assert created[0].max_active == 1
+    stats = registry.stats()[DEFAULT_MODEL]
+    assert stats["loaded"] is True
+    assert stats["leases_total"] == 4
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["max_queued"] >= 1
+
+
+def test_purge_waits_for_in_flight_lease():
+    registry = MultiModelEngine(engine_factory=CountingEngine)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def worker():
+        with registry.lease(DEFAULT_MODEL):
+            entered.set()
+            release.wait(2)
+
+    t = threading.Thread(target=worker)
+    t.start()
+    entered.wait(2)
+    threading.Timer(0.1, release.set).start()
+    start = time.time()
+    result = registry.purge()
+    assert time.time() - start >= 0.05
+    assert result == {"removed": 1, "remaining": 0}
+    t.join()
+    assert registry.list_models()[DEFAULT_MODEL]["loaded"] is False
+
+
+def test_lease_after_purge_reloads():
+    registry = MultiModelEngine(engine_factory=CountingEngine)
+    with registry.lease(None) as first:
+        pass
+    registry.purge(DEFAULT_MODEL)
+    with registry.lease(None) as second:
+        assert second is not first
+
+
+def test_new_slot_is_not_evicted_before_its_first_lease(monkeypatch):
+    monkeypatch.setattr(registry_module, "ALLOWED_MODELS", ["m/a", "m/b", "m/c"])
+    monkeypatch.setattr(registry_module, "MAX_MODELS_CACHE", 2)
+    registry = MultiModelEngine(engine_factory=CountingEngine)
+    with registry.lease("m/a"):
+        pass
+    # "m/b" se carga pero su primer lease aún no ha empezado
+    registry._slot("m/b")
+    with registry.lease("m/c"):
+        pass
+    loaded = {m for m, s in registry.list_models().items() if s["loaded"]}
+    assert loaded == {"m/b", "m/c"}
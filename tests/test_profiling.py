@@ -0,0 +1,69 @@
+import time
+import pytest
+import app.main as main_module
+import app.profiling as profiling_module
+from app.profiling import Profiler
+
+
+def _denoise_loop():
+    time.sleep(0.1)
+
+
+@pytest.fixture()
+def engine(engine):
+    # Generaciones de 0.1 s para que el muestreo capture el bucle de denoising
+    generate = engine.generate_image
+
+    def napping_generate(*args, **kwargs):
+        _denoise_loop()
+        return generate(*args, **kwargs)
+    engine.generate_image = napping_generate
+    return engine
+
+
+@pytest.fixture()
+def profiler(tmp_path, monkeypatch):
+    prof = Profiler()
+    monkeypatch.setattr(profiling_module, "PROFILES_DIR", str(tmp_path))
+    monkeypatch.setattr(main_module, "_PROFILER", prof)
+    return prof
+
+
+_payload = {"prompt": "x", "params": {"width": 64, "height": 64, "steps": 1, "cfg": 1}}
+
+
+def test_idle_tracker_is_passthrough():
+    prof = Profiler()
+    fn = lambda: 1  # noqa: E731
+    track = prof.begin("generate", "m")
+    assert track.session is None
+    assert track.wrap(fn) is fn
+
+
+def test_profile_next_request(profiler, client):
+    r = client.post("/v1/admin/profile", json={"requests": 1, "interval_ms": 1})
+    assert r.status_code == 202, r.text
+    session_id = r.json()["session_id"]
+    assert client.post("/v1/admin/profile", json={"seconds": 1}).status_code == 409
+
+    g = client.post("/v1/generate", json=_payload)
+    assert g.status_code == 200
+    assert g.json()["audit"]["profile"] == session_id
+
+    status = client.get("/v1/admin/profile").json()
+    assert status["status"] == "finished"
+    assert status["samples"] > 0
+    with open(status["files"]["python"]) as f:
+        folded = f.read()
+    assert "_denoise_loop" in folded
+    assert folded.splitlines()[0].startswith("generate;")
+    # La siguiente petición ya no se perfila
+    assert "profile" not in client.post("/v1/generate", json=_payload).json()["audit"]
+
+
+def test_slow_request_arms_automatic_profile(profiler, client, monkeypatch):
+    monkeypatch.setenv("PROFILE_SLOW_THRESHOLD_SECONDS", "0.01")
+    assert client.post("/v1/generate", json=_payload).status_code == 200
+    status = client.get("/v1/admin/profile").json()
+    assert status["reason"].startswith("slow:")
+    assert status["remaining_requests"] == 1
@@ -0,0 +1,40 @@
+from app.config import DEFAULT_MODEL
+from app.model_catalog import model_info
+
+
+def test_models_expose_recommended_defaults(client):
+    body = client.get("/v1/models").json()
+    assert "euler_a" in body["samplers"]
+    default = next(m for m in body["models"] if m["name"] == DEFAULT_MODEL)
+    info = model_info(DEFAULT_MODEL)
+    assert default["recommended_steps"] == info.recommended_steps
+    assert default["recommended_cfg"] == info.recommended_cfg
+
+
+def test_distilled_models_default_to_few_steps_without_cfg():
+    assert model_info("stabilityai/sdxl-turbo").recommended_cfg == 0.0
+    assert model_info("someone/sdxl-lightning").recommended_steps <= 4
+    assert model_info("someone/custom-sdxl").recommended_cfg > 1
+
+
+def test_generate_uses_model_defaults_when_omitted(client, engine):
+    r = client.post("/v1/generate", json={"prompt": "x", "params": {"width": 64, "height": 64}})
+    assert r.status_code == 200, r.text
+    info = model_info(DEFAULT_MODEL)
+    assert engine.calls[-1] == {"steps": info.recommended_steps, "cfg": info.recommended_cfg, "sampler": None}
+    assert r.json()["audit"]["steps"] == str(info.recommended_steps)
+
+
+def test_generate_with_sampler(client, engine):
+    payload = {"prompt": "x", "params": {"width": 64, "height": 64, "steps": 3, "cfg": 1, "sampler": "dpmpp_2m"}}
+    r = client.post("/v1/generate", json=payload)
+    assert r.status_code == 200, r.text
+    assert engine.calls[-1]["sampler"] == "dpmpp_2m"
+    assert r.json()["audit"]["sampler"] == "dpmpp_2m"
+
+
+def test_generate_unknown_sampler(client, engine):
+    payload = {"prompt": "x", "params": {"width": 64, "height": 64, "sampler": "nope"}}
+    r = client.post("/v1/generate", json=payload)
+    assert r.status_code == 400
+    assert "Unknown sampler" in r.json()["detail"]
@@ -0,0 +1,22 @@
+from app.startup_profile import measure_cold_start, parse_importtime, summarize_by_package
+
+# Presupuesto de arranque en frío de la app HTTP (sin ML); holgado para CI lentos
+COLD_START_BUDGET_SECONDS = 3.0
+
+
+def test_http_app_cold_start_without_ml_imports():
+    result = measure_cold_start(["app.main"])
+    assert result["heavy"] == [], f"heavy modules imported at startup: {result['heavy']}"
+    assert result["seconds"] < COLD_START_BUDGET_SECONDS
+
+
+def test_parse_importtime_report():
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |   fastapi.types",
+        "import time:       300 |        420 | fastapi",
+        "import time:        50 |        470 | app.main",
+    ])
+    records = parse_importtime(stderr)
+    assert [r.module for r in records] == ["fastapi.types", "fastapi", "app.main"]
+    assert summarize_by_package(records) == {"fastapi": 420, "app": 50}